@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+import metrics as mt
+import rag_handler as rh
+
+# Cache of generated answers, looked up by the similarity of the question embedding.
+# Entries are stored per collection and collection version, so an answer is never served after
+# the collection it was generated from has changed, and per model and prompt settings.
+# Expired entries are removed after ttl seconds, the least recently used ones beyond max_entries.
+class AnswerCache:
+    def __init__(self, config, manifest):
+        self.config = config
+        self.manifest = manifest
+        options = self.config.get("cache_options", {})
+        self.similarity_threshold = options.get("answer_similarity_threshold", 0.95)
+        self.ttl = options.get("answer_cache_ttl", 86400)
+        self.max_entries = options.get("answer_cache_size", 1000)
+        self.settings_key = self.make_settings_key()
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        database_folder = self.config["rag_options"]["database_folder"]
+        os.makedirs(database_folder, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(database_folder, "answer_cache.sqlite3"), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY, collection TEXT NOT NULL, version INTEGER NOT NULL, "
+                "settings TEXT NOT NULL, vector BLOB NOT NULL, answer TEXT NOT NULL, metadata TEXT NOT NULL, "
+                "created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS answers_lookup ON answers (collection, version, settings)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+
+    # Answers only carry over between runs with the same model, prompts and retrieval settings
+    def make_settings_key(self):
+        settings = {
+            "llm_options": {key: value for key, value in self.config["llm_options"].items() if key != "ollama_address"},
+            "embedding_options": {key: self.config.get("embedding_options", {}).get(key) for key in ("backend", "model")},
+            "rag_options": {key: self.config["rag_options"].get(key) for key in ("similarity_threshold", "results_to_return", "use_reranker", "rrf_k", "article_lookup")},
+            "reranker_options": self.config.get("reranker_options", {}),
+            "context_options": self.config.get("context_options", {}),
+            "index_options": self.config.get("index_options", {}),
+        }
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+    # Federated searches are cached under the comma separated names of their collections, with the sum of their versions,
+    # which goes up whenever one of them changes because versions never go down
+    def get_version(self, collection):
+        return sum(self.manifest.get_version(name) for name in collection.split(","))
+
+    # Questions naming an article are not cached: questions about neighbouring articles differ in one digit and would
+    # be served each other's answers, and the article lookup answers them without embedding the question
+    @staticmethod
+    def caches(question):
+        return rh.find_article_reference(question) is None
+
+    @staticmethod
+    def normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    # Returns the collection version and (answer, metadata) of the most similar cached question, or None.
+    # An answer generated after the lookup is stored with this version, so a collection changed meanwhile does not get it.
+    def lookup(self, collection, query_embedding):
+        version = self.get_version(collection)
+        query = self.normalize(query_embedding)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, vector FROM answers WHERE collection = ? AND version = ? AND settings = ? AND created >= ?",
+                (collection, version, self.settings_key, time.time() - self.ttl),
+            ).fetchall()
+            if not rows:
+                self.misses += 1
+                mt.increment("rag_cache_requests_total", cache="answer", result="miss")
+                return version, None
+
+            vectors = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+            if vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                mt.increment("rag_cache_requests_total", cache="answer", result="miss")
+                return version, None
+            similarities = vectors @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                mt.increment("rag_cache_requests_total", cache="answer", result="miss")
+                return version, None
+
+            with self.connection:
+                self.connection.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), rows[best][0]))
+            answer, metadata = self.connection.execute("SELECT answer, metadata FROM answers WHERE id = ?", (rows[best][0],)).fetchone()
+            self.hits += 1
+            mt.increment("rag_cache_requests_total", cache="answer", result="hit")
+            return version, (answer, json.loads(metadata))
+
+    def store(self, collection, version, query_embedding, answer, metadata=None):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO answers (collection, version, settings, vector, answer, metadata, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (collection, version, self.settings_key, self.normalize(query_embedding).tobytes(), answer, json.dumps(metadata or {}, default=str), now, now),
+            )
+            # Answers of older collection versions can never be served again
+            self.connection.execute("DELETE FROM answers WHERE collection = ? AND version < ?", (collection, version))
+            self.connection.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+            count = self.connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM answers")
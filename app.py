@@ -1,15 +1,22 @@
+import startup_timer as st
+startup_timer = st.StartupTimer()
+
 import json
 import logging
 # For directory watcher
 import os
-import watchdog
 from watchdog.observers import Observer
 
 import rag_handler as rh
+import answer_cache as ac
+import collection_snapshot as cs
+import ingestion_pipeline as ip
 import model_handler as mh
 import custom_formatter as cf
 
 
+startup_timer.mark("imports")
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.getLogger().handlers[0].setFormatter(cf.CustomFormatter())
 
@@ -30,39 +37,44 @@ if os.path.exists("config.local.json"):
                 config[key] = value
         read_file.close()
 
-# Watch the ingestion folder
-class FileSystemWatcher(watchdog.events.FileSystemEventHandler):
-    def on_created(self, event):
-        file_name = event.src_path.split('/')[-1]
-        if not file_name.startswith('.'):  # Ignore hidden files
-            logging.info(f"Detected and Ingesting: {event.src_path}\n")
-            docs = rag_handler.load_document(event.src_path)
-            # Delete the file after ingestion if thew option is true in config
-            if config["rag_options"]["delete_file_after_ingestion"] and os.path.exists(event.src_path):
-                os.remove(event.src_path)
-                logging.info(f"Deleted After Ingestion: {event.src_path}\n")
-            # Add the documents to the database
-            rag_handler.add_document_to_chroma(docs)
-            logging.info(f"Ingested: {event.src_path}\n")
-    def on_deleted(self, event):
-        logging.info(f"Deleted: {event.src_path}\n")
-
-# Start the folder observer
-observer = Observer()
-observer.schedule(FileSystemWatcher(), path=config["rag_options"]["ingestion_folder"], recursive=True)
-observer.start()
-
-# Initialize model and RAG handlers
-model_handler = mh.ModelHandler(config)
-rag_handler = rh.RAGHandler(config)
-
-# Load the model
-model = model_handler.load_model()
-if not model:
-    logging.error("Error loading model. Make sure you have installed the model and Ollama is running. Exiting...")
-    exit(1)
-if config["rag_options"]["clear_database_on_start"] and rag_handler.vector_store._collection.count() > 0:
-    rag_handler.vector_store.reset_collection()
+# Start-up is only run by the script itself, not when the module is imported by the ingestion worker processes
+def start():
+    global model_handler, rag_handler, answer_cache, ingestion_pipeline, observer
+    # Initialize model and RAG handlers, the model is checked once here
+    model_handler = mh.ModelHandler(config)
+    startup_timer.mark("model validation")
+    try:
+        rag_handler = rh.RAGHandler(config)
+    except ValueError as e:
+        logging.error(e)
+        exit(1)
+    startup_timer.mark("chroma open")
+
+    # Load the model into Ollama and the reranker model in the background, they are needed by the first question
+    if config["llm_options"].get("warm_up", True):
+        startup_timer.run_in_background("model warm-up", model_handler.warm_up)
+    if config["rag_options"].get("use_reranker", False) and config.get("reranker_options", {}).get("preload", True):
+        startup_timer.run_in_background("reranker load", rag_handler.reranker.load_model)
+    if hasattr(rag_handler.document_embeddings, "load_model"):
+        startup_timer.run_in_background("embedding model load", rag_handler.document_embeddings.load_model)
+
+    # Answers can only be reused when they do not depend on the conversation so far
+    answer_cache = None
+    if config.get("cache_options", {}).get("answer_cache", False) and not config["llm_options"]["use_short_term_memory"]:
+        answer_cache = ac.AnswerCache(config, rag_handler.manifest)
+
+    # Reset the collection before anything is ingested into it
+    if config["rag_options"]["clear_database_on_start"] and rag_handler.vector_store._collection.count() > 0:
+        rag_handler.reset_collection()
+
+    # Start the ingestion pipeline and the folder observer feeding it
+    ingestion_pipeline = ip.IngestionPipeline(config, rag_handler)
+    ingestion_pipeline.start()
+    observer = Observer()
+    observer.schedule(ip.FileSystemWatcher(ingestion_pipeline), path=config["rag_options"]["ingestion_folder"], recursive=True)
+    observer.start()
+    startup_timer.mark("ingestion start")
+    startup_timer.report()
 
 # Main loop
 def main():
@@ -72,6 +84,7 @@ def main():
             user_input = input(">> ")
             if user_input == "exit":
                 observer.stop()
+                ingestion_pipeline.stop()
                 logging.info(f"Exiting...")
                 break
             if user_input == "clear":
@@ -89,7 +102,11 @@ def main():
                     logging.error("Invalid collection number.")
                     continue
                 new_collection = collections[int(new_collection)-1].name
-                rag_handler.change_collection(new_collection)
+                try:
+                    rag_handler.change_collection(new_collection)
+                except ValueError as e:
+                    logging.error(e)
+                    continue
                 logging.info(f"Switched collection to: {new_collection}\n")
                 continue
 
@@ -100,6 +117,24 @@ def main():
                     logging.info(f"- {coll.name} (Count: {coll.count()})")
                 continue
 
+            if user_input == "ingest status":
+                status = ingestion_pipeline.status()
+                logging.info(f"Ingestion: {status['queued']} queued, {status['in_flight']} in flight, {status['done']} done, {status['failed']} failed, embedding {status['chunks_per_second']} chunks/sec")
+                continue
+
+            if user_input == "cache stats":
+                if hasattr(rag_handler.embeddings, "stats"):
+                    stats = rag_handler.embeddings.stats()
+                    logging.info(f"Query embedding cache: {stats['hits']} hits, {stats['misses']} misses, {stats['memory_entries']} in memory, {stats['disk_entries']} on disk")
+                else:
+                    logging.info("Query embedding cache is disabled.")
+                if answer_cache:
+                    stats = answer_cache.stats()
+                    logging.info(f"Answer cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+                else:
+                    logging.info("Answer cache is disabled.")
+                continue
+
             if user_input == "delete collection":
                 collections = rag_handler.list_collections()
                 for idx, coll in enumerate(collections):
@@ -115,24 +150,85 @@ def main():
                 logging.info(f"Deleted collection: {del_collection}\n")
                 continue
 
+            if user_input == "export collection":
+                collections = rag_handler.list_collections()
+                for idx, coll in enumerate(collections):
+                    logging.info(f"- {idx+1}. {coll.name} (Count: {coll.count()})")
+
+                export_collection = input("Enter collection number: ")
+                if not export_collection.isdigit() or int(export_collection) < 1 or int(export_collection) > len(collections):
+                    logging.error("Invalid collection number.")
+                    continue
+                export_collection = collections[int(export_collection)-1].name
+                default_path = os.path.join("snapshots", export_collection)
+                path = input(f"Enter snapshot folder (default: {default_path}): ").strip() or default_path
+                try:
+                    count = cs.export_collection(rag_handler, export_collection, path)
+                except ValueError as e:
+                    logging.error(e)
+                    continue
+                logging.info(f"Exported {count} chunks of {export_collection} to: {path}\n")
+                continue
+
+            if user_input == "import collection":
+                path = input("Enter snapshot folder: ").strip()
+                try:
+                    header = cs.read_header(path)
+                except (OSError, ValueError) as e:
+                    logging.error(f"Invalid snapshot: {e}")
+                    continue
+                import_collection = input(f"Enter collection name (default: {header['collection']}): ").strip() or header["collection"]
+                try:
+                    count = cs.import_collection(rag_handler, path, import_collection)
+                except ValueError as e:
+                    logging.error(e)
+                    continue
+                logging.info(f"Imported {count} chunks into: {import_collection}\n")
+                continue
+
+            # Reuse the answer to a similar question asked about the same collection contents
+            collection_name = rag_handler.search_scope()
+            query_embedding = None
+            use_cache = answer_cache is not None and answer_cache.caches(user_input)
+            if use_cache:
+                query_embedding = rag_handler.embed_query(user_input)
+                cache_version, cached = answer_cache.lookup(collection_name, query_embedding)
+                if cached:
+                    logging.info("Answer found in cache.")
+                    print(f"Response: \n{cf.yellow}{cached[0]}{cf.reset}")
+                    print(f"\n")
+                    continue
+
             # Use RAG if chromadb exists, otherwise, just use the model
-            if rag_handler.vector_store._collection.count() > 0:
-                related_docs = rag_handler.get_docs_by_similarity(user_input)
+            if rag_handler.has_documents(collection_name):
+                related_docs = rag_handler.search(user_input, query_embedding, collection_name)
                 logging.info(f"Related docs: {len(related_docs)}")  # Debug
-                response = model_handler.get_response(user_input, related_docs, True)
+                stream = model_handler.stream_response(user_input, related_docs, True)
             else:
                 logging.warning("No documents in database, using only the model.")  # Debug
-                response = model_handler.get_response(user_input, None, False)
-            
-            logging.debug(f"Done Reason: {response.response_metadata.get('done_reason')}")  # Debug
-            logging.debug(f"Token Count: {response.response_metadata.get('total_tokens')}")  # Debug
-
-            print(f"Response: \n{cf.yellow}{response.content}{cf.reset}")
+                stream = model_handler.stream_response(user_input, None, False)
+
+            # Print tokens as they arrive
+            print(f"Response: \n{cf.yellow}", end="", flush=True)
+            metadata = {}
+            answer = ""
+            for chunk in stream:
+                print(chunk.content, end="", flush=True)
+                answer += chunk.content
+                metadata.update(chunk.response_metadata)
+            print(f"{cf.reset}")
+            if use_cache and answer:
+                answer_cache.store(collection_name, cache_version, query_embedding, answer, metadata)
+
+            logging.debug(f"Done Reason: {metadata.get('done_reason')}")  # Debug
+            logging.debug(f"Token Count: {metadata.get('total_tokens')}")  # Debug
             print(f"\n")
     except KeyboardInterrupt:
         observer.stop()
+        ingestion_pipeline.stop()
         logging.info("Exiting...")
     observer.join()
 
 if __name__ == '__main__':
+    start()
     main()
\ No newline at end of file
@@ -0,0 +1,59 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+import batch_answering as ba
+import custom_formatter as cf
+import model_handler as mh
+import rag_handler as rh
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger().handlers[0].setFormatter(cf.CustomFormatter())
+
+# Answer a JSONL file of questions without the interactive loop, see batch_answering.py
+def main():
+    # Load configuration
+    with open("config.json", mode="r", encoding="utf-8") as read_file:
+        config = json.load(read_file)
+
+    # Load local configuration overrides if exists
+    if os.path.exists("config.local.json"):
+        with open("config.local.json", mode="r", encoding="utf-8") as read_file:
+            local_config = json.load(read_file)
+            for key, value in local_config.items():
+                if key in config and isinstance(config[key], dict) and isinstance(value, dict):
+                    config[key].update(value)
+                else:
+                    config[key] = value
+
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions into a JSONL file of answers.")
+    parser.add_argument("questions_file", type=str,
+                help="JSONL file with one {\"question\": ..., \"id\": ..., \"collection\": ...} object per line, id and collection are optional.\n")
+    parser.add_argument("answers_file", type=str,
+                help="JSONL file the answers are appended to, questions it already has answers for are skipped.\n")
+    parser.add_argument("--collection-name", type=str, default=None,
+                help="Collection to search, the one in config.json by default.\n")
+    parser.add_argument("--restart", action="store_true", default=False,
+                help="Delete the answers of a previous run and answer every question again.\n")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.questions_file):
+        logging.error(f"Questions file does not exist: {args.questions_file}")
+        sys.exit(1)
+
+    model_handler = mh.ModelHandler(config)
+    try:
+        rag_handler = rh.RAGHandler(config)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+    if args.collection_name and args.collection_name not in [coll.name for coll in rag_handler.list_collections()]:
+        logging.error(f"Collection {args.collection_name} does not exist.")
+        sys.exit(1)
+    batch_answerer = ba.BatchAnswerer(config, rag_handler, model_handler)
+    batch_answerer.run(args.questions_file, args.answers_file, args.restart, args.collection_name)
+
+if __name__ == "__main__":
+    main()
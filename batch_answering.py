@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+STOP = object()
+
+# Questions of a JSONL file, one {"question": ..., "id": ..., "collection": ...} object per line.
+# The id defaults to the line number and the collection to the one the batch is run on.
+def read_questions(path):
+    with open(path, mode="r", encoding="utf-8") as read_file:
+        for line_number, line in enumerate(read_file, start=1):
+            if not line.strip():
+                continue
+            question = json.loads(line)
+            if isinstance(question, str):
+                question = {"question": question}
+            question.setdefault("id", line_number)
+            yield question
+
+# Ids of the questions an output file already has answers for, failed ones are answered again
+def answered_ids(path):
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+    with open(path, mode="r", encoding="utf-8") as read_file:
+        for line in read_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line of an interrupted run may be cut off
+                continue
+            if "error" not in record:
+                ids.add(record["id"])
+    return ids
+
+# Answers a file of questions into a JSONL file of answers with their sources and timings.
+# Embedding, retrieval (with reranking) and generation run as a pipeline of stages connected by bounded queues,
+# each with its own number of worker threads, so the stages of different questions overlap.
+# Answers are appended as they are finished, a run started again on the same output skips the answered questions.
+# Pass the generation slots of the web app so batch answers count against its cap on concurrent generations.
+class BatchAnswerer:
+    def __init__(self, config, rag_handler, model_handler, generation_slots=None):
+        self.config = config
+        self.rag_handler = rag_handler
+        self.model_handler = model_handler
+        self.generation_slots = generation_slots
+        options = self.config.get("batch_options", {})
+        self.workers = {
+            "embed": options.get("embed_workers", 4),
+            "retrieve": options.get("retrieval_workers", 4),
+            "generate": options.get("generation_workers", 2),
+        }
+        self.queue_size = options.get("queue_size", 64)
+
+        self.lock = threading.Lock()
+        self.running = False
+        self.total = 0
+        self.skipped = 0
+        self.done = 0
+        self.failed = 0
+        self.started = None
+
+    def status(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started if self.started else 0
+            return {
+                "running": self.running,
+                "total": self.total,
+                "skipped": self.skipped,
+                "done": self.done,
+                "failed": self.failed,
+                "questions_per_minute": round(self.done * 60 / elapsed, 1) if elapsed else 0.0,
+            }
+
+    # Run the batch in a background thread
+    def start(self, input_path, output_path, restart=False, collection_name=None):
+        with self.lock:
+            self.running = True
+        thread = threading.Thread(target=self.run, args=(input_path, output_path, restart, collection_name), daemon=True)
+        thread.start()
+        return thread
+
+    def run(self, input_path, output_path, restart=False, collection_name=None):
+        with self.lock:
+            self.running = True
+            self.started = time.perf_counter()
+        try:
+            if restart and os.path.exists(output_path):
+                os.remove(output_path)
+            done_ids = answered_ids(output_path)
+            questions = [question for question in read_questions(input_path) if question["id"] not in done_ids]
+            with self.lock:
+                self.total = len(questions) + len(done_ids)
+                self.skipped = len(done_ids)
+            if done_ids:
+                logging.info(f"Resuming: {len(done_ids)} questions already answered, {len(questions)} left")
+
+            stages = [("embed", self.embed), ("retrieve", self.retrieve), ("generate", self.generate)]
+            queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(stages) + 1)]
+            threads = []
+            for (name, function), in_queue, out_queue in zip(stages, queues, queues[1:]):
+                threads.append([
+                    threading.Thread(target=self.stage_loop, args=(function, in_queue, out_queue), name=f"batch-{name}", daemon=True)
+                    for _ in range(self.workers[name])
+                ])
+            writer = threading.Thread(target=self.write_loop, args=(queues[-1], output_path), name="batch-write", daemon=True)
+            for thread in [thread for stage_threads in threads for thread in stage_threads] + [writer]:
+                thread.start()
+
+            for question in questions:
+                question["collection"] = question.get("collection") or collection_name
+                question["timings"] = {}
+                queues[0].put(question)
+            # Every stage is stopped once the stage before it has finished
+            for stage_threads, in_queue in zip(threads, queues):
+                for _ in stage_threads:
+                    in_queue.put(STOP)
+                for thread in stage_threads:
+                    thread.join()
+            queues[-1].put(STOP)
+            writer.join()
+            logging.info(f"Batch done: {self.status()}")
+        finally:
+            with self.lock:
+                self.running = False
+
+    def stage_loop(self, function, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is STOP:
+                return
+            if "error" not in item:
+                start = time.perf_counter()
+                try:
+                    function(item)
+                except Exception as e:
+                    logging.error(f"Failed to answer question {item['id']}: {e}")
+                    item["error"] = str(e)
+                item["timings"][function.__name__] = time.perf_counter() - start
+            out_queue.put(item)
+
+    def embed(self, item):
+        # Opening a collection creates it, a misspelled name would be answered from an empty one
+        if item["collection"] and item["collection"] not in {coll.name for coll in self.rag_handler.list_collections()}:
+            raise ValueError(f"Collection {item['collection']} does not exist")
+        item["scope"] = self.rag_handler.search_scope(item["collection"])
+        item["query_embedding"] = None
+        if self.rag_handler.has_documents(item["scope"]):
+            item["query_embedding"] = self.rag_handler.embed_query(item["question"])
+
+    def retrieve(self, item):
+        item["docs"] = None
+        if item["query_embedding"] is not None:
+            item["docs"] = self.rag_handler.search(item["question"], item["query_embedding"], item["scope"])
+
+    def generate(self, item):
+        # Batch questions wait for a free slot as long as it takes, they have no client waiting on them
+        if self.generation_slots:
+            self.generation_slots.acquire()
+        try:
+            # Every question is answered on its own, without the history of the others
+            item["response"] = self.model_handler.get_response(item["question"], item["docs"], item["docs"] is not None, self.model_handler.new_conversation())
+        finally:
+            if self.generation_slots:
+                self.generation_slots.release()
+
+    def write_loop(self, in_queue, output_path):
+        last_report = time.monotonic()
+        with open(output_path, mode="a", encoding="utf-8") as write_file:
+            while True:
+                item = in_queue.get()
+                if item is STOP:
+                    return
+                write_file.write(json.dumps(self.make_record(item), ensure_ascii=False, default=str) + "\n")
+                write_file.flush()
+                with self.lock:
+                    if "error" in item:
+                        self.failed += 1
+                    else:
+                        self.done += 1
+                if time.monotonic() - last_report >= 10:
+                    last_report = time.monotonic()
+                    status = self.status()
+                    logging.info(f"Progress: {status['done'] + status['skipped']} of {status['total']} answered, {status['failed']} failed, {status['questions_per_minute']} questions/min")
+
+    @staticmethod
+    def make_record(item):
+        record = {"id": item["id"], "question": item["question"]}
+        if "error" in item:
+            record["error"] = item["error"]
+        else:
+            response = item["response"]
+            record["answer"] = response.content
+            record["done_reason"] = response.response_metadata.get("done_reason")
+            record["total_tokens"] = response.response_metadata.get("total_tokens")
+            record["sources"] = [
+                {key: doc.metadata[key] for key in ("source", "collection", "page", "row", "clen", "del_clena") if key in doc.metadata} | {"id": doc.id}
+                for doc in item["docs"] or []
+            ]
+        record["timings"] = {stage: round(seconds * 1000, 3) for stage, seconds in item["timings"].items()}
+        return record
@@ -0,0 +1,221 @@
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import custom_formatter as cf
+import ollama_stub as stub_server
+import rag_handler as rh
+import script_helpers as sh
+import model_handler as mh
+import ingest_txt
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger().handlers[0].setFormatter(cf.CustomFormatter())
+
+# Offline benchmark of ingestion, retrieval, reranking and answering.
+# Ollama is replaced by a local stand-in with deterministic embeddings and simulated latency,
+# synthetic law-like corpora of increasing size are ingested into a temporary database
+# and the measurements are written to a JSON file, so runs before and after a change can be compared.
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "po", "ra", "si", "ta", "vu", "ze", "br", "st", "kr", "dn", "ob", "av", "il", "ur", "ek", "jo"]
+
+def make_vocabulary(rng, size=3000):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+# Write a text file shaped like the laws ingest_txt.py is written for: chapters of numbered articles.
+# Returns the article texts, queries are drawn from them.
+def make_corpus(path, article_count, seed):
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    articles = []
+    with open(path, mode="w", encoding="utf-8") as file:
+        for number in range(1, article_count + 1):
+            if number % 50 == 1:
+                file.write(f"\n{'I' * (1 + (number // 50) % 3)}. poglavje {rng.choice(vocabulary)}\n")
+            sentences = []
+            for _ in range(rng.randint(3, 8)):
+                words = [rng.choice(vocabulary) for _ in range(rng.randint(8, 20))]
+                sentences.append(" ".join(words).capitalize() + ".")
+            text = " ".join(sentences)
+            articles.append(text)
+            file.write(f"\n{number}. člen\n{text}\n")
+    return articles
+
+def make_queries(articles, count, seed):
+    rng = random.Random(seed + 1)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(articles).rstrip(".").lower().split()
+        start = rng.randint(0, max(0, len(words) - 6))
+        queries.append(" ".join(words[start:start + 6]))
+    return queries
+
+def latency_summary(seconds):
+    milliseconds = [value * 1000 for value in seconds]
+    return {
+        "count": len(milliseconds),
+        "mean_ms": round(sum(milliseconds) / len(milliseconds), 3) if milliseconds else None,
+        "p50_ms": round(sh.percentile(milliseconds, 0.50), 3) if milliseconds else None,
+        "p95_ms": round(sh.percentile(milliseconds, 0.95), 3) if milliseconds else None,
+        "p99_ms": round(sh.percentile(milliseconds, 0.99), 3) if milliseconds else None,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+# Ingest one synthetic corpus and measure every stage on it
+def run_size(base_config, stub, article_count, args):
+    work_folder = tempfile.mkdtemp(prefix="rag-benchmark-")
+    try:
+        config = copy.deepcopy(base_config)
+        config["rag_options"]["database_folder"] = os.path.join(work_folder, "database")
+        config["rag_options"]["collection_name"] = "benchmark"
+        config["rag_options"]["use_reranker"] = args.rerank
+        config["llm_options"]["ollama_address"] = stub.address
+        # Every query is embedded again, end to end latency and retrieval latency include the embedding
+        config.setdefault("cache_options", {}).update({"answer_cache": False, "embedding_cache": False})
+
+        corpus_path = os.path.join(work_folder, "corpus.txt")
+        articles = make_corpus(corpus_path, article_count, args.seed)
+        queries = make_queries(articles, args.queries, args.seed)
+        result = {"articles": article_count, "corpus_bytes": os.path.getsize(corpus_path)}
+
+        # ingest_txt.py splitter
+        documents = rh.load_document(corpus_path)
+        start = time.perf_counter()
+        split_chunks = ingest_txt.create_splitter(config).split_text_with_metadata(documents[0].page_content, "corpus.txt")
+        elapsed = time.perf_counter() - start
+        result["split"] = {"chunks": len(split_chunks), "seconds": round(elapsed, 4), "chunks_per_second": round(len(split_chunks) / elapsed, 1) if elapsed else None}
+
+        # Loading, splitting, embedding and storing through RAGHandler
+        rag_handler = rh.RAGHandler(config)
+        start = time.perf_counter()
+        documents = rag_handler.load_document(corpus_path)
+        load_seconds = time.perf_counter() - start
+        rag_handler.add_document_to_chroma(documents)
+        elapsed = time.perf_counter() - start
+        chunks = rag_handler.vector_store._collection.count()
+        result["ingest"] = {
+            "chunks": chunks,
+            "load_seconds": round(load_seconds, 4),
+            "seconds": round(elapsed, 4),
+            "chunks_per_second": round(chunks / elapsed, 1) if elapsed else None,
+        }
+
+        # Retrieval, the first query opens the lexical index and is not counted
+        rag_handler.get_docs_by_similarity(queries[0])
+        retrieval_seconds = []
+        for query in queries:
+            start = time.perf_counter()
+            rag_handler.get_docs_by_similarity(query)
+            retrieval_seconds.append(time.perf_counter() - start)
+        result["retrieval"] = latency_summary(retrieval_seconds)
+
+        # Cross-encoder cost on uncached candidates
+        result["rerank"] = None
+        if args.rerank:
+            rerank_seconds = []
+            candidates = 0
+            for query in queries:
+                docs = rag_handler.get_docs_by_similarity(query)[:rag_handler.reranker.max_candidates]
+                start = time.perf_counter()
+                rag_handler.reranker.score(query, docs)
+                rerank_seconds.append(time.perf_counter() - start)
+                candidates += len(docs)
+            result["rerank"] = latency_summary(rerank_seconds)
+            result["rerank"]["ms_per_candidate"] = round(sum(rerank_seconds) * 1000 / candidates, 3) if candidates else None
+
+        # Question to answer
+        model_handler = mh.ModelHandler(config)
+        end_to_end_seconds = []
+        for query in queries[:args.answers]:
+            start = time.perf_counter()
+            related_docs = rag_handler.get_docs_by_similarity(query)
+            model_handler.get_response(query, related_docs, True)
+            end_to_end_seconds.append(time.perf_counter() - start)
+        result["end_to_end"] = latency_summary(end_to_end_seconds)
+        return result
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, retrieval and answering against a local Ollama stand-in.")
+    parser.add_argument("--sizes", type=str, default="100,500,2000",
+                help="Comma separated numbers of articles of the synthetic corpora.\n")
+    parser.add_argument("--queries", type=int, default=50,
+                help="Retrieval queries per corpus.\n")
+    parser.add_argument("--answers", type=int, default=10,
+                help="Questions answered end to end per corpus.\n")
+    parser.add_argument("--rerank", action="store_true", default=False,
+                help="Measure the reranker too, its model must already be downloaded.\n")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dimensions", type=int, default=1024)
+    parser.add_argument("--embed-latency-ms", type=float, default=5,
+                help="Simulated latency of every embedding request.\n")
+    parser.add_argument("--embed-item-latency-ms", type=float, default=1,
+                help="Simulated latency added per embedded text.\n")
+    parser.add_argument("--chat-latency-ms", type=float, default=50,
+                help="Simulated time to the first generated token.\n")
+    parser.add_argument("--token-latency-ms", type=float, default=2,
+                help="Simulated time per generated token.\n")
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--output", type=str, default="benchmark_results.json",
+                help="File the results are written to.\n")
+    args = parser.parse_args()
+
+    config = sh.load_config()
+    stub_options = {
+        "dimensions": args.dimensions,
+        "embed_latency_ms": args.embed_latency_ms,
+        "embed_item_latency_ms": args.embed_item_latency_ms,
+        "chat_latency_ms": args.chat_latency_ms,
+        "token_latency_ms": args.token_latency_ms,
+        "answer_tokens": args.answer_tokens,
+    }
+    stub = stub_server.OllamaStub(models=[config["llm_options"]["model"]], **stub_options).start()
+    logging.info(f"Ollama stand-in listening on {stub.address}")
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "stub": stub_options,
+        "runs": [],
+    }
+    try:
+        for size in [int(size) for size in args.sizes.split(",") if size.strip()]:
+            logging.info(f"Benchmarking a corpus of {size} articles...")
+            run = run_size(config, stub, size, args)
+            results["runs"].append(run)
+            logging.info(
+                f"{size} articles: {run['ingest']['chunks']} chunks, ingest {run['ingest']['chunks_per_second']} chunks/sec, "
+                f"split {run['split']['chunks_per_second']} chunks/sec, retrieval p50 {run['retrieval']['p50_ms']} ms "
+                f"p95 {run['retrieval']['p95_ms']} ms p99 {run['retrieval']['p99_ms']} ms, "
+                f"end to end p50 {run['end_to_end']['p50_ms']} ms"
+                + (f", rerank {run['rerank']['ms_per_candidate']} ms/candidate" if run["rerank"] else "")
+            )
+        results["stub_requests"] = stub.request_counts()
+    finally:
+        stub.stop()
+
+    with open(args.output, mode="w", encoding="utf-8") as write_file:
+        json.dump(results, write_file, indent=4)
+    logging.info(f"Results written to: {args.output}")
+
+if __name__ == "__main__":
+    main()
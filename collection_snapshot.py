@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+import numpy as np
+
+# Snapshots of a collection that can be loaded again without embedding anything.
+# A snapshot is a folder of columns, one row per chunk:
+#   snapshot.json     collection name, embedding model, row count and vector dimensions
+#   vectors.npy       float32 matrix of the vectors, read memory-mapped
+#   ids.jsonl, documents.jsonl, metadatas.jsonl   one JSON value per line
+SNAPSHOT_FORMAT = 1
+COLUMNS = ("ids", "documents", "metadatas")
+
+def read_header(path):
+    with open(os.path.join(path, "snapshot.json"), mode="r", encoding="utf-8") as read_file:
+        header = json.load(read_file)
+    if header.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format: {header.get('format')}")
+    return header
+
+# Write a collection to a snapshot folder in batches, returns the number of exported chunks.
+# Chunks added while the export runs may be left out.
+def export_collection(rag_handler, collection_name, path, batch_size=5000):
+    collection = rag_handler.get_vector_store(collection_name)._collection
+    total = collection.count()
+    if total == 0:
+        raise ValueError(f"Collection {collection_name} is empty")
+    os.makedirs(path, exist_ok=True)
+    start = time.perf_counter()
+
+    files = {column: open(os.path.join(path, f"{column}.jsonl"), mode="w", encoding="utf-8") for column in COLUMNS}
+    vectors = None
+    exported = 0
+    try:
+        while exported < total:
+            batch = collection.get(limit=min(batch_size, total - exported), offset=exported, include=["embeddings", "documents", "metadatas"])
+            if not batch["ids"]:
+                break
+            embeddings = np.asarray(batch["embeddings"], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(os.path.join(path, "vectors.npy"), mode="w+", dtype=np.float32, shape=(total, embeddings.shape[1]))
+            vectors[exported:exported + len(embeddings)] = embeddings
+            for column in COLUMNS:
+                files[column].writelines(json.dumps(value, ensure_ascii=False) + "\n" for value in batch[column])
+            exported += len(batch["ids"])
+        if vectors is None:
+            raise ValueError(f"Collection {collection_name} is empty")
+        dimensions = vectors.shape[1]
+        vectors.flush()
+    finally:
+        for file in files.values():
+            file.close()
+        del vectors
+
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "collection": collection_name,
+        "embedding_model": rag_handler.manifest.get_embedding_model(collection_name) or rag_handler.embedding_model,
+        "count": exported,
+        "dimensions": dimensions,
+        "created": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(path, "snapshot.json"), mode="w", encoding="utf-8") as write_file:
+        json.dump(header, write_file, indent=4)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Exported {exported} chunks of {collection_name} in {elapsed:.1f}s ({exported / max(elapsed, 1e-9):.1f} chunks/sec)")
+    return exported
+
+# Load a snapshot into an empty collection, by default the one it was exported from.
+# Vectors are stored as they are, so the snapshot must come from the configured embedding model.
+# The full text index and the ingest manifest are filled too. Returns the number of imported chunks.
+def import_collection(rag_handler, path, collection_name=None, batch_size=5000):
+    header = read_header(path)
+    collection_name = collection_name or header["collection"]
+    if header["embedding_model"] != rag_handler.embedding_model:
+        raise ValueError(
+            f"Snapshot was embedded with {header['embedding_model']}, but embedding_options select {rag_handler.embedding_model}"
+        )
+    collection = rag_handler.get_vector_store(collection_name)._collection
+    if collection.count() > 0:
+        raise ValueError(f"Collection {collection_name} is not empty, delete it or import into another collection")
+    lexical_index = rag_handler.get_lexical_index(collection_name)
+    rag_handler.manifest.set_embedding_model(collection_name, rag_handler.embedding_model)
+    # Chroma limits how many records one call may add
+    if hasattr(collection._client, "get_max_batch_size"):
+        batch_size = min(batch_size, collection._client.get_max_batch_size())
+    start = time.perf_counter()
+
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+    files = {column: open(os.path.join(path, f"{column}.jsonl"), mode="r", encoding="utf-8") for column in COLUMNS}
+    imported = 0
+    try:
+        while imported < header["count"]:
+            size = min(batch_size, header["count"] - imported)
+            batch = {column: [json.loads(next(files[column])) for _ in range(size)] for column in COLUMNS}
+            collection.add(
+                ids=batch["ids"],
+                embeddings=np.ascontiguousarray(vectors[imported:imported + size]),
+                documents=batch["documents"],
+                metadatas=batch["metadatas"],
+            )
+            lexical_index.add(batch["ids"], [document or "" for document in batch["documents"]])
+            sources = defaultdict(list)
+            for chunk_id, metadata in zip(batch["ids"], batch["metadatas"]):
+                sources[(metadata or {}).get("source")].append(chunk_id)
+            for source, ids in sources.items():
+                if source is not None:
+                    rag_handler.manifest.add_chunk_ids(collection_name, source, ids)
+            imported += size
+            elapsed = time.perf_counter() - start
+            logging.info(f"Progress: {imported} of {header['count']} chunks, {imported / max(elapsed, 1e-9):.1f} chunks/sec")
+    finally:
+        for file in files.values():
+            file.close()
+        del vectors
+    return imported
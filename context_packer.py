@@ -0,0 +1,116 @@
+import hashlib
+import re
+
+# Shortest text two chunks must share before it is treated as splitter overlap
+MIN_OVERLAP_CHARS = 20
+SHINGLE_WORDS = 5
+
+# Article and part number ingest_txt.py puts in front of every chunk of a law, the overlap is in the text after it
+ARTICLE_HEADER = re.compile(r"\Ačlen številka:[^\n]*\n(?:del člena:[^\n]*\n)?\n")
+
+# Count tokens with tiktoken if it is installed, otherwise estimate them from the text length
+def create_token_counter(encoding_name="cl100k_base"):
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(encoding_name)
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return lambda text: (len(text) + 3) // 4
+
+# Assemble the context of a prompt from retrieved chunks.
+# Chunks are taken in score order until the token budget is filled, exact and near duplicates are dropped,
+# and text a chunk shares with an already taken chunk of the same source (the splitter overlap) is cut off.
+class ContextPacker:
+    def __init__(self, config):
+        self.config = config
+        options = self.config.get("context_options", {})
+        self.max_tokens = options.get("max_tokens", 4096)
+        self.near_duplicate_threshold = options.get("near_duplicate_threshold", 0.8)
+        self.max_overlap = max(self.config["splitter_options"]["chunk_overlap"], MIN_OVERLAP_CHARS)
+        self.tokenizer = options.get("tokenizer", "cl100k_base")
+        self.token_counter = None
+
+    # The tokenizer is loaded on first use, it may have to be downloaded
+    def count_tokens(self, text):
+        if self.token_counter is None:
+            self.token_counter = create_token_counter(self.tokenizer)
+        return self.token_counter(text)
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.split()).casefold()
+
+    @staticmethod
+    def shingles(text):
+        words = re.findall(r"\w+", text.casefold())
+        if len(words) <= SHINGLE_WORDS:
+            return {" ".join(words)}
+        return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+    def is_near_duplicate(self, shingles, taken_shingles):
+        for other in taken_shingles:
+            union = len(shingles | other)
+            if union and len(shingles & other) / union >= self.near_duplicate_threshold:
+                return True
+        return False
+
+    # Length of the longest end of first that is also the start of second
+    def overlap_length(self, first, second):
+        for length in range(min(len(first), len(second), self.max_overlap), MIN_OVERLAP_CHARS - 1, -1):
+            if first.endswith(second[:length]):
+                return length
+        return 0
+
+    # Returns the article header of a chunk, or "", and the text after it
+    @staticmethod
+    def split_header(text):
+        match = ARTICLE_HEADER.match(text)
+        return (match.group(0), text[match.end():]) if match else ("", text)
+
+    # Cut the text a chunk shares with the taken chunks of its source
+    def trim_overlap(self, text, source_texts):
+        for other in source_texts:
+            length = self.overlap_length(other, text)
+            if length:
+                text = text[length:]
+            length = self.overlap_length(text, other)
+            if length:
+                text = text[:-length]
+        return text.strip()
+
+    # Returns the packed context string and the documents it was built from
+    def pack(self, docs):
+        taken = []
+        parts = []
+        seen_hashes = set()
+        taken_shingles = []
+        texts_by_source = {}
+        used_tokens = 0
+
+        for doc in docs:
+            content_hash = hashlib.sha256(self.normalize(doc.page_content).encode("utf-8")).hexdigest()
+            if content_hash in seen_hashes:
+                continue
+            shingles = self.shingles(doc.page_content)
+            if self.is_near_duplicate(shingles, taken_shingles):
+                continue
+
+            source = doc.metadata.get("source")
+            header, body = self.split_header(doc.page_content)
+            text = self.trim_overlap(body, texts_by_source.get(source, []))
+            if not text:
+                continue
+            text = header + text
+            tokens = self.count_tokens(text + "\n")
+            # Chunks that do not fit are skipped, a later, shorter one may still fit
+            if used_tokens + tokens > self.max_tokens:
+                continue
+
+            used_tokens += tokens
+            seen_hashes.add(content_hash)
+            taken_shingles.append(shingles)
+            texts_by_source.setdefault(source, []).append(body)
+            parts.append(text)
+            taken.append(doc)
+
+        return "".join(part + "\n" for part in parts), taken
@@ -0,0 +1,52 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+# Short-term memory of one conversation: a rolling summary of the older turns and the recent turns verbatim.
+# Turns hold the user's question, not the prompt with the retrieved context, and the answer.
+# Messages are only ever appended until the turns pass max_tokens, then the oldest ones are folded into
+# the summary down to half the budget, so the prompt prefix stays the same for many turns and Ollama
+# can reuse its prompt cache.
+class ConversationMemory:
+    def __init__(self, count_tokens, max_tokens=4096, keep_turns=2):
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summary = ""
+        self.turns = []  # (question message, answer message, tokens)
+
+    def clear(self):
+        self.summary = ""
+        self.turns.clear()
+
+    def __len__(self):
+        return len(self.turns)
+
+    def messages(self):
+        messages = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"Summary of the conversation so far:\n{self.summary}"))
+        for question, answer, _ in self.turns:
+            messages += [question, answer]
+        return messages
+
+    def add(self, question, answer):
+        question = HumanMessage(content=question)
+        answer = AIMessage(content=answer.content, response_metadata=answer.response_metadata)
+        self.turns.append((question, answer, self.count_tokens(question.content) + self.count_tokens(answer.content)))
+
+    def tokens(self):
+        return self.count_tokens(self.summary) + sum(tokens for _, _, tokens in self.turns)
+
+    # The oldest turns to fold into the summary, none while the memory is within its budget
+    def turns_to_compact(self):
+        if self.tokens() <= self.max_tokens:
+            return []
+        remaining = self.tokens()
+        count = 0
+        while count < len(self.turns) - self.keep_turns and remaining > self.max_tokens // 2:
+            remaining -= self.turns[count][2]
+            count += 1
+        return self.turns[:count]
+
+    def compact(self, summary, count):
+        self.summary = summary
+        del self.turns[:count]
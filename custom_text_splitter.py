@@ -2,33 +2,123 @@ from langchain.schema import Document
 from langchain.text_splitter import TextSplitter
 import re
 
+# Structure of Slovenian laws, one line each: Prvi del: ..., II. poglavje ..., 1.1. naslov, 23. člen
+ARTICLE_PATTERN = re.compile(r"^\s*(?P<clen>\d{1,4})\.(?:.*)? člen\s*$", re.IGNORECASE)
+PART_PATTERN = re.compile(r"^.* del: .*$", re.IGNORECASE)
+CHAPTER_PATTERN = re.compile(r"^\s*[IVXLC]{1,6}\. poglavje.*$", re.IGNORECASE)
+# Sections named as such are headings wherever they are
+NAMED_SECTION_PATTERN = re.compile(r"^\s*\d{1,3}\.\s*(?:pod)?oddelek\b.*$", re.IGNORECASE)
+# Other numbered titles look just like the numbered points of an article ("3. zavarovanec"),
+# so they are only sections between articles: before the first one or right after another heading
+SECTION_PATTERN = re.compile(r"^\s*\d\.(?:(?:\d{1,3}\.)?\d{1,3}\.?)?\s+\S.{0,100}(?<![.,;:])$")
+
+# Splits law texts in a single pass over their lines.
+# Part (del), chapter (poglavje), section and article (člen) headings are not chunk text but metadata of the chunks
+# below them, and articles are cut into parts (del člena) of at most chunk_size characters, overlapping by chunk_overlap.
+# The heading state can be passed in and is kept in self.state, so a text can be split in consecutive pieces.
 class CustomTextSplitter(TextSplitter):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, chunk_size=1024, chunk_overlap=100, state=None):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.state = {"del": None, "poglavje": None, "oddelek": None, "clen": None, "del_clena": 0, "after_heading": False} if state is None else state
+
+    def split_text(self, text: str) -> list[str]:
+        return [document.page_content for document in self.split_text_with_metadata(text)]
 
-    def split_text_with_metadata(self, text: str) -> list[Document]:
+    def split_text_with_metadata(self, text: str, source_file=None) -> list[Document]:
         """
-        Splits text into chunks starting with 'XXX. člen' at the beginning of a line.
-        Returns a list of Documents with lowercase content, original text, and člen number.
+        Splits text into chunks of articles, starting a new chunk at every 'XXX. člen' line.
+        Returns a list of Documents with lowercase content prefixed with the article and part number,
+        the original text and the heading hierarchy in the metadata.
         """
-        # Match lines that start with a number followed by '. člen'
-        pattern = re.compile(r'^\s*(?P<clen>\d+)\. člen', re.MULTILINE)
-        matches = list(pattern.finditer(text))
-
-        documents = []
-        for i, match in enumerate(matches):
-            start = match.start()
-            end = matches[i+1].start() if i + 1 < len(matches) else len(text)
-            original_chunk = text[start:end].strip()
-            clen_number = match.group("clen")
-
-            doc = Document(
-                page_content=original_chunk.lower(),
-                metadata={
-                    "original_text": original_chunk,
-                    "clen": clen_number
-                }
-            )
-            documents.append(doc)
-
-        return documents
+        return list(self.split_lines(text.splitlines(), source_file))
+
+    def split_lines(self, lines, source_file=None):
+        lines_in_chunk = []
+        size = 0
+        for line in lines:
+            line = line.rstrip("\r\n")
+            heading = self.match_heading(line)
+            if heading:
+                # A heading ends the chunk of the article before it
+                yield from self.make_chunk(lines_in_chunk, source_file)
+                lines_in_chunk = []
+                size = 0
+                self.state.update(heading)
+                continue
+            if not line.strip():
+                continue
+            self.state["after_heading"] = False
+
+            for piece in self.cut_line(line):
+                if lines_in_chunk and size + len(piece) + 1 > self._chunk_size:
+                    yield from self.make_chunk(lines_in_chunk, source_file)
+                    lines_in_chunk = self.overlap_tail(lines_in_chunk)
+                    size = sum(len(kept) + 1 for kept in lines_in_chunk)
+                    while lines_in_chunk and size + len(piece) + 1 > self._chunk_size:
+                        size -= len(lines_in_chunk.pop(0)) + 1
+                lines_in_chunk.append(piece)
+                size += len(piece) + 1
+        yield from self.make_chunk(lines_in_chunk, source_file)
+
+    # If the line is a heading, returns the changes it makes to the heading state
+    def match_heading(self, line):
+        match = ARTICLE_PATTERN.match(line)
+        if match:
+            return {"clen": match.group("clen"), "del_clena": 0, "after_heading": False}
+        if PART_PATTERN.match(line):
+            return {"del": line.strip(), "poglavje": None, "oddelek": None, "after_heading": True}
+        if CHAPTER_PATTERN.match(line):
+            return {"poglavje": line.strip(), "oddelek": None, "after_heading": True}
+        if NAMED_SECTION_PATTERN.match(line):
+            return {"oddelek": line.strip(), "after_heading": True}
+        between_articles = self.state["clen"] is None or self.state.get("after_heading", False)
+        if between_articles and SECTION_PATTERN.match(line):
+            return {"oddelek": line.strip(), "after_heading": True}
+        return None
+
+    # Cut a line longer than the chunk size at spaces
+    def cut_line(self, line):
+        if len(line) <= self._chunk_size:
+            return [line]
+        pieces = []
+        piece = ""
+        for word in line.split(" "):
+            while len(word) > self._chunk_size:
+                if piece:
+                    pieces.append(piece)
+                    piece = ""
+                pieces.append(word[:self._chunk_size])
+                word = word[self._chunk_size:]
+            if piece and len(piece) + len(word) + 1 > self._chunk_size:
+                pieces.append(piece)
+                piece = word
+            else:
+                piece = f"{piece} {word}" if piece else word
+        if piece:
+            pieces.append(piece)
+        return pieces
+
+    # The last lines of a chunk that fit into the overlap, they start the next chunk
+    def overlap_tail(self, lines):
+        tail = []
+        size = 0
+        for line in reversed(lines):
+            if size + len(line) + 1 > self._chunk_overlap:
+                break
+            tail.insert(0, line)
+            size += len(line) + 1
+        return tail
+
+    def make_chunk(self, lines, source_file):
+        if not lines:
+            return
+        self.state["del_clena"] += 1
+        original_chunk = f"člen številka: {self.state['clen']}\ndel člena: {self.state['del_clena']}\n\n" + "\n".join(lines)
+        metadata = {"original_text": original_chunk, "del_clena": self.state["del_clena"]}
+        # Chroma does not store empty metadata values
+        for key in ("clen", "del", "poglavje", "oddelek"):
+            if self.state[key] is not None:
+                metadata[key] = self.state[key]
+        if source_file is not None:
+            metadata["source_file"] = source_file
+        yield Document(page_content=original_chunk.lower(), metadata=metadata)
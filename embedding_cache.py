@@ -0,0 +1,118 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+
+import metrics as mt
+
+# Query embedding cache in front of another embedding function.
+# Vectors are kept in an in-memory LRU backed by a SQLite table under the database folder,
+# keyed by embedding model and normalized query text, so repeated questions survive restarts.
+# Document embeddings are passed through, chunks are embedded only once anyway.
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, model_name, database_folder, max_entries=50000, memory_entries=1024):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(database_folder, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(database_folder, "embedding_cache.sqlite3"), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS query_embeddings_last_used ON query_embeddings (last_used)")
+            self.count = self.connection.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+    # Collapse whitespace, unicode forms and letter case, so trivially different questions share an entry
+    @staticmethod
+    def normalize(text):
+        return " ".join(unicodedata.normalize("NFKC", text).split()).casefold()
+
+    def cache_key(self, text):
+        return hashlib.sha256(f"{self.model_name}\x00{self.normalize(text)}".encode("utf-8")).hexdigest()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+            "disk_entries": self.count,
+        }
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = self.cache_key(text)
+        vector = self.lookup(key)
+        if vector is not None:
+            return vector
+
+        vector = self.embeddings.embed_query(text)
+        self.store(key, vector)
+        return vector
+
+    def lookup(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                mt.increment("rag_cache_requests_total", cache="query_embedding", result="hit")
+                return self.memory[key]
+
+            row = self.connection.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                mt.increment("rag_cache_requests_total", cache="query_embedding", result="miss")
+                return None
+
+            with self.connection:
+                self.connection.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+            vector = array("f", row[0]).tolist()
+            self.remember(key, vector)
+            self.hits += 1
+            mt.increment("rag_cache_requests_total", cache="query_embedding", result="hit")
+            return vector
+
+    def store(self, key, vector):
+        with self.lock:
+            self.remember(key, vector)
+            with self.connection:
+                # A key can be stored again after two misses at once or after it left the memory cache,
+                # only keys that are new to the table are counted
+                exists = self.connection.execute("SELECT 1 FROM query_embeddings WHERE key = ?", (key,)).fetchone() is not None
+                self.connection.execute(
+                    "INSERT INTO query_embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET model = excluded.model, vector = excluded.vector, last_used = excluded.last_used",
+                    (key, self.model_name, array("f", vector).tobytes(), time.time()),
+                )
+                if not exists:
+                    self.count += 1
+                # Evict the least recently used tenth once the table is over its size,
+                # counted again first as another process may share the table
+                if self.count > self.max_entries:
+                    self.count = self.connection.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+                if self.count > self.max_entries:
+                    evict = self.count - int(self.max_entries * 0.9)
+                    self.connection.execute(
+                        "DELETE FROM query_embeddings WHERE key IN (SELECT key FROM query_embeddings ORDER BY last_used LIMIT ?)",
+                        (evict,),
+                    )
+                    self.count = self.connection.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+    def remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# Deterministic chunk ids from the source and a hash of the chunk content.
+# Repeated identical chunks in one source are told apart by their occurrence number,
+# pass the same occurrences dict when a source is ingested in several batches.
+# Callers that count occurrences per part of a source pass a run number that tells repeated parts apart.
+def chunk_ids(source, chunks, occurrences=None, run=0):
+    occurrences = {} if occurrences is None else occurrences
+    ids = []
+    for chunk in chunks:
+        content_hash = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+        occurrence = occurrences.get(content_hash, 0)
+        occurrences[content_hash] = occurrence + 1
+        key = f"{source}\x00{content_hash}\x00{occurrence}" + (f"\x00{run}" if run else "")
+        ids.append(hashlib.sha256(key.encode("utf-8")).hexdigest())
+    return ids
+
+# Records which chunk ids were stored for every source file of a collection,
+# so re-ingestion only embeds changed chunks and removes the ones that disappeared.
+# Every collection also has a version number that goes up whenever its contents change.
+class IngestManifest:
+    def __init__(self, database_folder):
+        os.makedirs(database_folder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(database_folder, "ingest_manifest.sqlite3"), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS source_chunks (collection TEXT NOT NULL, source TEXT NOT NULL, chunk_id TEXT NOT NULL, "
+                "PRIMARY KEY (collection, source, chunk_id))"
+            )
+            self.connection.execute("CREATE TABLE IF NOT EXISTS collection_versions (collection TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS collection_models (collection TEXT PRIMARY KEY, model TEXT NOT NULL)")
+            # Progress of streamed ingestions, so an interrupted one continues where it stopped
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS ingest_checkpoints (collection TEXT NOT NULL, source TEXT NOT NULL, checkpoint TEXT NOT NULL, "
+                "PRIMARY KEY (collection, source))"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS ingest_seen (collection TEXT NOT NULL, source TEXT NOT NULL, chunk_id TEXT NOT NULL, "
+                "PRIMARY KEY (collection, source, chunk_id))"
+            )
+
+    def get_version(self, collection):
+        with self.lock:
+            row = self.connection.execute("SELECT version FROM collection_versions WHERE collection = ?", (collection,)).fetchone()
+        return row[0] if row else 0
+
+    # Called inside a transaction that changed the collection
+    def bump_version(self, collection):
+        self.connection.execute(
+            "INSERT INTO collection_versions (collection, version) VALUES (?, 1) "
+            "ON CONFLICT (collection) DO UPDATE SET version = version + 1",
+            (collection,),
+        )
+
+    # The embedding model the vectors of a collection were made with, None if it has none recorded
+    def get_embedding_model(self, collection):
+        with self.lock:
+            row = self.connection.execute("SELECT model FROM collection_models WHERE collection = ?", (collection,)).fetchone()
+        return row[0] if row else None
+
+    # Record the model of a collection when its first vectors are stored, a recorded model is kept
+    def set_embedding_model(self, collection, model):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO collection_models (collection, model) VALUES (?, ?)", (collection, model))
+
+    def get_chunk_ids(self, collection, source):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT chunk_id FROM source_chunks WHERE collection = ? AND source = ?", (collection, source)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    # The given chunk ids that are already recorded for a source
+    def find_chunk_ids(self, collection, source, ids):
+        found = set()
+        ids = list(ids)
+        with self.lock:
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT chunk_id FROM source_chunks WHERE collection = ? AND source = ? AND chunk_id IN ({placeholders})",
+                    [collection, source, *batch],
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def add_chunk_ids(self, collection, source, ids):
+        with self.lock, self.connection:
+            added = self.connection.executemany(
+                "INSERT OR IGNORE INTO source_chunks (collection, source, chunk_id) VALUES (?, ?, ?)",
+                [(collection, source, chunk_id) for chunk_id in ids],
+            ).rowcount
+            if added > 0:
+                self.bump_version(collection)
+
+    def remove_chunk_ids(self, collection, source, ids):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM source_chunks WHERE collection = ? AND source = ? AND chunk_id = ?",
+                [(collection, source, chunk_id) for chunk_id in ids],
+            )
+            # Chunks stored before the manifest are removed too, even though they were never recorded
+            if ids:
+                self.bump_version(collection)
+
+    def has_source(self, collection, source):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT 1 FROM source_chunks WHERE collection = ? AND source = ? LIMIT 1", (collection, source)
+            ).fetchone() is not None
+
+    def get_checkpoint(self, collection, source):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT checkpoint FROM ingest_checkpoints WHERE collection = ? AND source = ?", (collection, source)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Store the progress of a streamed ingestion together with the chunk ids it has written so far
+    def save_checkpoint(self, collection, source, checkpoint, ids):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO ingest_seen (collection, source, chunk_id) VALUES (?, ?, ?)",
+                [(collection, source, chunk_id) for chunk_id in ids],
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO ingest_checkpoints (collection, source, checkpoint) VALUES (?, ?, ?)",
+                (collection, source, json.dumps(checkpoint)),
+            )
+
+    def clear_checkpoint(self, collection, source):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM ingest_checkpoints WHERE collection = ? AND source = ?", (collection, source))
+            self.connection.execute("DELETE FROM ingest_seen WHERE collection = ? AND source = ?", (collection, source))
+
+    # Chunk ids of a source that the streamed ingestion has not written, a page at a time
+    def unseen_chunk_ids(self, collection, source, limit=1000):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT chunk_id FROM source_chunks WHERE collection = ? AND source = ? AND chunk_id NOT IN "
+                "(SELECT chunk_id FROM ingest_seen WHERE collection = ? AND source = ?) LIMIT ?",
+                (collection, source, collection, source, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def drop_collection(self, collection):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM source_chunks WHERE collection = ?", (collection,))
+            self.connection.execute("DELETE FROM ingest_checkpoints WHERE collection = ?", (collection,))
+            self.connection.execute("DELETE FROM ingest_seen WHERE collection = ?", (collection,))
+            self.connection.execute("DELETE FROM collection_models WHERE collection = ?", (collection,))
+            # The version is kept, so a collection created again under the same name does not reuse old versions
+            self.bump_version(collection)
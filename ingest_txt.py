@@ -1,114 +1,218 @@
-import logging, json, os, sys, argparse, re
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-import chromadb
-from langchain_community.embeddings import FastEmbedEmbeddings
-from langchain_ollama import OllamaEmbeddings
+import logging, json, os, sys, argparse, time
 from langchain_community.document_loaders import TextLoader
 import custom_formatter as cf
+import ingest_manifest as im
+import rag_handler as rh
 import custom_text_splitter
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.getLogger().handlers[0].setFormatter(cf.CustomFormatter())
 
-# Load configuration
-with open("config.json", mode="r", encoding="utf-8") as read_file:
-    global config
-    config = json.load(read_file)
-    read_file.close()
-
-# Load local configuration overrides if exists
-if os.path.exists("config.local.json"):
-    with open("config.local.json", mode="r", encoding="utf-8") as read_file:
-        local_config = json.load(read_file)
-        for key, value in local_config.items():
-            if key in config and isinstance(config[key], dict) and isinstance(value, dict):
-                config[key].update(value)
-            else:
-                config[key] = value
-        read_file.close()
-
 length_function = len
 
-# Command line arguments
-parser = argparse.ArgumentParser(add_help=False)
-parser.add_argument("-h", "--help", action="help",
-            help="To run this script please provide input text file as an argument.\n")
-parser.add_argument("txt_file", type=str, nargs="?",
-            help="Path to the input text file to be ingested into the vector database.\n")
-parser.add_argument("--dry-run", action="store_true", default=False,
-            help="If set, the script will only print the splits without adding them to the database.\n")
-parser.add_argument("--collection-name", type=str, default="information",
-            help="Name of the collection in the vector database.\n")
-args, unknown = parser.parse_known_args()
-
-if not args.txt_file or not os.path.exists(args.txt_file):
-    logging.error(f"Input file parameter does not exist.")
-    sys.exit(1)
-
-# The default list of split characters is [\n\n, \n, " ", ""]
-# Tries to split on them in order until the chunks are small enough
-# Keep paragraphs, sentences, words together as long as possible
-# deli po: Prvi del, II. poglavje, 1.1. naslov, 23. člen, konec odstavka, konec stavka, presledek
-splitter = RecursiveCharacterTextSplitter(
-    separators=[r".* del: .*\n", r"^[I,V,X]{1,2}\. poglavje.*\n", r"\n\d\.(?:(?:\d{1,3}\.)?\d{1,3})?.*\n", r"\n(?:\ *)?\d{1,4}\.(?:.*)? člen\n", r"\n", r" ", r""],
-    is_separator_regex=True,
-    chunk_size=config["splitter_options"]["chunk_size"], 
-    chunk_overlap=config["splitter_options"]["chunk_overlap"],
-    length_function=length_function,
-)
-
-# Load and split the document
-loader = TextLoader(args.txt_file, encoding="utf-8")
-documents = loader.load()
-chunks = splitter.split_documents(documents)
-
-max_len = max([length_function(s.page_content) for s in chunks])
-
-# Add lowercase source file metadata to each chunk
-current_article_part_no = 1
-current_article_no = None
-for chunk in chunks:
-    match = re.search(r"^(?:\ *)?\d{1,4}\.(?:.*)? člen\n", chunk.page_content)
-    if match:
-        current_article_part_no = 1
-        current_article_no = match.group(0).split(". člen")[0].strip()
-        # Remove the article title from the content
-        lines = chunk.page_content.splitlines()
-        chunk.page_content = '\n'.join(lines[1:])
-
-    if not match and current_article_no:
-        current_article_part_no += 1
-
-
-    chunk.page_content = f"člen številka: {current_article_no}\ndel člena: {current_article_part_no}\n\n{chunk.page_content}"
-
-    chunk.metadata["original_text"] = chunk.page_content
-    chunk.metadata["clen"] = current_article_no
-    chunk.page_content = chunk.page_content.lower()
-    chunk.metadata["source_file"] = os.path.basename(args.txt_file).lower()
-
-if not args.dry_run:
-    logging.info(f"Adding document to the database, collection: {args.collection_name}")
-    vector_store = Chroma(
-        collection_name=args.collection_name,
-        persist_directory=config["rag_options"]["database_folder"],
-        #embedding_function=FastEmbedEmbeddings(),
-        #embedding_function=OllamaEmbeddings(model="nomic-embed-text",base_url=config["llm_options"]["ollama_address"]),
-        embedding_function=OllamaEmbeddings(model="bge-m3",base_url=config["llm_options"]["ollama_address"]),
-
-        client_settings=chromadb.config.Settings(
-            anonymized_telemetry=False,
-        ),
+# A line that starts an article, like "23. člen"
+ARTICLE_HEADER = custom_text_splitter.ARTICLE_PATTERN
+# Long articles are split into segments of about this many chunks when streaming
+SEGMENT_CHUNKS = 64
+
+# Single pass splitter that keeps del, poglavje, section, člen and part numbers as chunk metadata.
+# Pass a state to continue the heading state of a previous call, like when streaming a file segment by segment.
+def create_splitter(config, state=None):
+    return custom_text_splitter.CustomTextSplitter(
+        chunk_size=config["splitter_options"]["chunk_size"],
+        chunk_overlap=config["splitter_options"]["chunk_overlap"],
+        state=state,
     )
 
-    vector_store.add_documents(chunks)
-    logging.info(f"Added document to the database.")
-
-for i, split in enumerate(chunks):
-    logging.warning(f"--- Split {i+1} ---")
-    print(split.page_content)
-    print()
-
-logging.info(f"Number of splits: {len(chunks)}")
-logging.info(f"Max split length: {max_len}")
+# Read a text file a segment at a time, a segment is one article or a piece of a long one.
+# Yields (segment text, byte offset of the end of the segment), starting at the given offset.
+def read_segments(path, offset=0, max_chars=65536):
+    with open(path, mode="rb") as file:
+        file.seek(offset)
+        lines = []
+        size = 0
+        for raw_line in file:
+            line = raw_line.decode("utf-8-sig" if offset == 0 else "utf-8")
+            if ARTICLE_HEADER.match(line) and lines:
+                yield "".join(lines), offset
+                lines = []
+                size = 0
+            lines.append(line)
+            size += len(line)
+            offset += len(raw_line)
+            if size >= max_chars:
+                yield "".join(lines), offset
+                lines = []
+                size = 0
+        if lines:
+            yield "".join(lines), offset
+
+# Split a file into article-aware chunks without reading all of it.
+# Yields (chunks of one segment, byte offset after the segment), state is updated as segments are split.
+def stream_chunks(path, config, file_name, state=None, offset=0):
+    splitter = create_splitter(config, state)
+    max_chars = config["splitter_options"]["chunk_size"] * SEGMENT_CHUNKS
+    for segment, end_offset in read_segments(path, offset, max_chars):
+        yield splitter.split_text_with_metadata(segment, file_name), end_offset
+
+# Ingest a large text file with flat memory: chunks are embedded and stored in batches as the file is read,
+# and a checkpoint is saved after every batch, so an interrupted run continues from the last one.
+def ingest_streaming(rag_handler, config, path, source, batch_size, restart=False):
+    manifest = rag_handler.manifest
+    collection_name = rag_handler.vector_store._collection.name
+    file_size = os.path.getsize(path)
+    file_mtime = os.path.getmtime(path)
+
+    checkpoint = None if restart else manifest.get_checkpoint(collection_name, source)
+    if checkpoint and (checkpoint["file_size"] != file_size or checkpoint["file_mtime"] != file_mtime):
+        logging.warning("The file changed since the last checkpoint, starting over.")
+        checkpoint = None
+    if checkpoint:
+        logging.info(f"Resuming from byte {checkpoint['offset']} ({checkpoint['chunks']} chunks already stored)")
+    else:
+        manifest.clear_checkpoint(collection_name, source)
+        # Chunks stored before the manifest existed are recorded in it, so they are removed if they are gone from the file
+        if not manifest.has_source(collection_name, source):
+            collection = rag_handler.vector_store._collection
+            offset = 0
+            while True:
+                legacy_ids = collection.get(where=rh.legacy_source_filter(source), limit=5000, offset=offset, include=[])["ids"]
+                if not legacy_ids:
+                    break
+                manifest.add_chunk_ids(collection_name, source, legacy_ids)
+                offset += len(legacy_ids)
+        checkpoint = {"file_size": file_size, "file_mtime": file_mtime, "offset": 0, "chunks": 0,
+                      "state": create_splitter(config).state, "occurrences": {}, "article_runs": {}}
+
+    state = checkpoint["state"]
+    # Identical chunks are told apart per article, chunk contents start with the article number anyway.
+    # Article numbers repeat in the transitional provisions of amending acts, so every run of the same number
+    # after the first gets its own run number in the chunk ids.
+    occurrences = checkpoint["occurrences"]
+    article_runs = checkpoint.setdefault("article_runs", {})
+    batch = []
+    batch_ids = []
+    started = time.perf_counter()
+    written = 0
+
+    def flush(offset):
+        nonlocal batch, batch_ids, written
+        if batch:
+            rag_handler.add_chunks_to_chroma(batch, source, collection_name=collection_name, ids=batch_ids)
+        checkpoint.update({"offset": offset, "chunks": checkpoint["chunks"] + len(batch), "state": dict(state), "occurrences": occurrences, "article_runs": article_runs})
+        manifest.save_checkpoint(collection_name, source, checkpoint, batch_ids)
+        written += len(batch)
+        elapsed = time.perf_counter() - started
+        logging.info(f"Progress: {checkpoint['chunks']} chunks, {offset / max(file_size, 1) * 100:.1f}% of the file, {written / max(elapsed, 1e-9):.1f} chunks/sec")
+        batch = []
+        batch_ids = []
+
+    article_no = state["clen"]
+    run = max(article_runs.get(str(article_no), 1) - 1, 0)
+    for chunks, offset in stream_chunks(path, config, source, state, checkpoint["offset"]):
+        for chunk in chunks:
+            if chunk.metadata.get("clen") != article_no:
+                article_no = chunk.metadata.get("clen")
+                occurrences.clear()
+                run = article_runs.get(str(article_no), 0)
+                article_runs[str(article_no)] = run + 1
+            batch_ids += im.chunk_ids(source, [chunk], occurrences, run)
+            batch.append(chunk)
+        if len(batch) >= batch_size:
+            flush(offset)
+    flush(file_size)
+
+    # Remove the chunks of the previous version of the file that were not written again
+    removed = 0
+    while True:
+        stale = manifest.unseen_chunk_ids(collection_name, source)
+        if not stale:
+            break
+        removed += rag_handler.delete_chunks(source, stale, collection_name)
+    manifest.clear_checkpoint(collection_name, source)
+    return checkpoint["chunks"], removed
+
+def main():
+    # Load configuration
+    with open("config.json", mode="r", encoding="utf-8") as read_file:
+        config = json.load(read_file)
+
+    # Load local configuration overrides if exists
+    if os.path.exists("config.local.json"):
+        with open("config.local.json", mode="r", encoding="utf-8") as read_file:
+            local_config = json.load(read_file)
+            for key, value in local_config.items():
+                if key in config and isinstance(config[key], dict) and isinstance(value, dict):
+                    config[key].update(value)
+                else:
+                    config[key] = value
+
+    # Command line arguments
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-h", "--help", action="help",
+                help="To run this script please provide input text file as an argument.\n")
+    parser.add_argument("txt_file", type=str, nargs="?",
+                help="Path to the input text file to be ingested into the vector database.\n")
+    parser.add_argument("--dry-run", action="store_true", default=False,
+                help="If set, the script will only print the splits without adding them to the database.\n")
+    parser.add_argument("--collection-name", type=str, default="information",
+                help="Name of the collection in the vector database.\n")
+    parser.add_argument("--stream", action="store_true", default=False,
+                help="Read, split and store the file in batches with flat memory use, for very large files.\n")
+    parser.add_argument("--batch-size", type=int, default=config.get("ingestion_options", {}).get("write_batch_size", 256),
+                help="Chunks embedded and stored per batch when streaming.\n")
+    parser.add_argument("--restart", action="store_true", default=False,
+                help="When streaming, ignore the checkpoint of an interrupted run and start from the beginning.\n")
+    args, unknown = parser.parse_known_args()
+
+    if not args.txt_file or not os.path.exists(args.txt_file):
+        logging.error(f"Input file parameter does not exist.")
+        sys.exit(1)
+
+    source = os.path.basename(args.txt_file).lower()
+    if args.stream:
+        if args.dry_run:
+            count = 0
+            for chunks, _ in stream_chunks(args.txt_file, config, source):
+                for split in chunks:
+                    count += 1
+                    logging.warning(f"--- Split {count} ---")
+                    print(split.page_content)
+                    print()
+            logging.info(f"Number of splits: {count}")
+            return
+
+        logging.info(f"Streaming document to the database, collection: {args.collection_name}")
+        rag_handler = rh.RAGHandler(config, args.collection_name)
+        count, removed = ingest_streaming(rag_handler, config, args.txt_file, source, args.batch_size, args.restart)
+        logging.info(f"Added document to the database. ({count} chunks, {removed} removed)")
+        return
+
+    # Load and split the document, chunks get lowercase content and the article metadata
+    loader = TextLoader(args.txt_file, encoding="utf-8")
+    documents = loader.load()
+    chunks = create_splitter(config).split_text_with_metadata(documents[0].page_content, source)
+
+    max_len = max([length_function(s.page_content) for s in chunks])
+
+    if not args.dry_run:
+        logging.info(f"Adding document to the database, collection: {args.collection_name}")
+        # Goes through RAGHandler so the full text index and the ingest manifest are kept up to date,
+        # re-ingesting a changed file only embeds the changed chunks
+        rag_handler = rh.RAGHandler(config, args.collection_name)
+        previous_ids = rag_handler.get_source_chunk_ids(source)
+        ids = rag_handler.add_chunks_to_chroma(chunks, source)
+        rag_handler.remove_stale_chunks(source, ids, previous_ids)
+        logging.info(f"Added document to the database.")
+
+    else:
+        for i, split in enumerate(chunks):
+            logging.warning(f"--- Split {i+1} ---")
+            print(split.page_content)
+            print()
+
+    logging.info(f"Number of splits: {len(chunks)}")
+    logging.info(f"Max split length: {max_len}")
+
+if __name__ == "__main__":
+    main()
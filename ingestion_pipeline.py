@@ -0,0 +1,252 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import watchdog.events
+
+import metrics as mt
+import rag_handler as rh
+
+# Runs in a worker process: parse the file and split it into chunks.
+# Returns the chunks and the seconds it took, metrics are recorded by the parent process.
+def load_and_split(config, path):
+    start = time.perf_counter()
+    documents = rh.load_document(path)
+    if documents is None:
+        return None, time.perf_counter() - start
+    return rh.create_text_splitter(config).split_documents(documents), time.perf_counter() - start
+
+# Runs in a worker process: parse a range of pages of a PDF and split them into chunks
+def load_and_split_pages(config, path, start_page, end_page):
+    start = time.perf_counter()
+    documents = rh.load_pdf_pages(path, start_page, end_page)
+    return rh.create_text_splitter(config).split_documents(documents), time.perf_counter() - start
+
+# The parsed parts of a file in order, waiting for each part only when it is needed
+def future_results(futures):
+    for future in futures:
+        yield future.result()
+
+# Background ingestion fed by the folder watcher.
+# Files are debounced until their size stops changing, parsed and split in a process pool,
+# and embedded and written in batches by a single writer thread.
+# Large PDFs are parsed as page ranges in parallel and CSV files are read in batches of rows by the writer,
+# so the first parts of a file are stored while the rest is still being parsed.
+# The number of parsed files waiting to be written is bounded, which holds back the parse stage.
+class IngestionPipeline:
+    def __init__(self, config, rag_handler):
+        self.config = config
+        self.rag_handler = rag_handler
+        options = self.config.get("ingestion_options", {})
+        self.debounce_seconds = options.get("debounce_seconds", 2)
+        self.parse_workers = options.get("parse_workers") or os.cpu_count() or 1
+        self.write_batch_size = options.get("write_batch_size", 256)
+        self.pdf_pages_per_task = options.get("pdf_pages_per_task", 50)
+        self.csv_batch_rows = options.get("csv_batch_rows", 1000)
+
+        self.pending = {}  # path -> (size, time the size was last seen changing)
+        self.parse_queue = queue.Queue(maxsize=options.get("queue_size", 64))
+        self.write_queue = queue.Queue()
+        # Parsed files waiting for the writer count as in flight, so this also bounds the write queue
+        self.in_flight_slots = threading.BoundedSemaphore(self.parse_workers * 2)
+        # Files removed by delete_file_after_ingestion, their chunks must stay in the database
+        self.deleted_after_ingestion = set()
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.done = 0
+        self.failed = 0
+
+        self.running = False
+        self.threads = []
+        # Spawned workers only import the modules, forking would copy the locks held by the other threads of the parent
+        self.pool = ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def start(self):
+        self.running = True
+        for target in (self.debounce_loop, self.dispatch_loop, self.write_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def status(self):
+        with self.lock:
+            return {
+                "queued": len(self.pending) + self.parse_queue.qsize(),
+                "in_flight": self.in_flight,
+                "done": self.done,
+                "failed": self.failed,
+                "chunks_per_second": round(self.rag_handler.document_embeddings.throughput(), 1),
+            }
+
+    # Register a created or modified file, it is parsed once its size is stable
+    def submit(self, path):
+        with self.lock:
+            self.pending[path] = (-1, time.monotonic())
+
+    # Remove the chunks of a deleted file. The writer runs it after the writes of the file dispatched before it,
+    # files dispatched after it are skipped by dispatch_loop because they no longer exist.
+    def submit_delete(self, path):
+        with self.lock:
+            self.pending.pop(path, None)
+            self.in_flight += 1
+            self.write_queue.put(("delete", path, None))
+
+    def debounce_loop(self):
+        while self.running:
+            time.sleep(0.5)
+            ready = []
+            with self.lock:
+                now = time.monotonic()
+                for path, (last_size, changed_at) in list(self.pending.items()):
+                    if not os.path.exists(path):
+                        del self.pending[path]
+                        continue
+                    size = os.path.getsize(path)
+                    if size != last_size:
+                        self.pending[path] = (size, now)
+                    elif now - changed_at >= self.debounce_seconds:
+                        del self.pending[path]
+                        ready.append(path)
+            for path in ready:
+                # Blocks while the parse queue is full
+                self.parse_queue.put(path)
+
+    def dispatch_loop(self):
+        while self.running:
+            try:
+                path = self.parse_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if not os.path.exists(path):
+                continue
+            self.in_flight_slots.acquire()
+            futures = [] if path.endswith(".csv") else self.submit_parsing(path)
+            # The write is queued in dispatch order, so a delete of the file submitted later is run after it.
+            # The writer waits for each part when it gets to it.
+            with self.lock:
+                exists = os.path.exists(path)
+                if exists:
+                    self.in_flight += 1
+                    self.write_queue.put(("write", path, self.csv_parts(path) if path.endswith(".csv") else future_results(futures)))
+            if not exists:
+                for future in futures:
+                    future.cancel()
+                self.in_flight_slots.release()
+
+    # Parse a file in the process pool, returns the futures of its parts in order
+    def submit_parsing(self, path):
+        if path.endswith(".pdf"):
+            try:
+                pages = rh.count_pdf_pages(path)
+            except Exception as e:
+                # Loading the whole file reports the error
+                logging.warning(f"Could not count the pages of {path}: {e}")
+                pages = 0
+            if pages > self.pdf_pages_per_task:
+                return [
+                    self.pool.submit(load_and_split_pages, self.config, path, start, start + self.pdf_pages_per_task)
+                    for start in range(0, pages, self.pdf_pages_per_task)
+                ]
+        return [self.pool.submit(load_and_split, self.config, path)]
+
+    # Read and split a CSV file in batches of rows, in the writer thread
+    def csv_parts(self, path):
+        text_splitter = rh.create_text_splitter(self.config)
+        documents = rh.iter_csv_documents(path, self.csv_batch_rows)
+        while True:
+            start = time.perf_counter()
+            batch = next(documents, None)
+            if batch is None:
+                return
+            yield text_splitter.split_documents(batch), time.perf_counter() - start
+
+    def write_loop(self):
+        while self.running:
+            try:
+                action, path, parts = self.write_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if action == "delete":
+                    removed = self.rag_handler.remove_source(path)
+                    logging.info(f"Removed {removed} chunks of: {path}\n")
+                else:
+                    self.write(path, parts)
+                    mt.increment("rag_documents_ingested_total", result="done")
+                with self.lock:
+                    self.done += 1
+            except Exception as e:
+                logging.error(f"Failed to ingest {path}: {e}")
+                mt.increment("rag_documents_ingested_total", result="failed")
+                with self.lock:
+                    self.failed += 1
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                if action == "write":
+                    self.in_flight_slots.release()
+
+    # Embed and store the chunks of the parsed parts of one file in batches, as the parts arrive,
+    # then remove the chunks that are no longer in it
+    def write(self, path, parts):
+        # Bind the whole file to the collection that is active when writing starts
+        collection_name = self.rag_handler.vector_store._collection.name
+        previous_ids = None
+        occurrences = {}
+        ids = []
+        write_seconds = 0.0
+        for chunks, parse_seconds in parts:
+            if chunks is None:
+                raise ValueError("Unsupported file type")
+            mt.observe("ingest_parse", parse_seconds)
+            start = time.perf_counter()
+            if previous_ids is None:
+                previous_ids = self.rag_handler.get_source_chunk_ids(path, collection_name)
+            for i in range(0, len(chunks), self.write_batch_size):
+                batch = chunks[i:i + self.write_batch_size]
+                ids += self.rag_handler.add_chunks_to_chroma(batch, path, occurrences, collection_name)
+            write_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        removed = self.rag_handler.remove_stale_chunks(path, ids, previous_ids, collection_name)
+        mt.observe("ingest_write", write_seconds + time.perf_counter() - start)
+
+        # Delete the file after ingestion if thew option is true in config
+        if self.config["rag_options"]["delete_file_after_ingestion"] and os.path.exists(path):
+            self.deleted_after_ingestion.add(path)
+            os.remove(path)
+            logging.info(f"Deleted After Ingestion: {path}\n")
+        logging.info(f"Ingested: {path} ({len(ids)} chunks, {removed} removed)\n")
+
+# Watch the ingestion folder and feed the pipeline
+class FileSystemWatcher(watchdog.events.FileSystemEventHandler):
+    def __init__(self, pipeline):
+        super().__init__()
+        self.pipeline = pipeline
+
+    def on_created(self, event):
+        file_name = event.src_path.split('/')[-1]
+        if not event.is_directory and not file_name.startswith('.'):  # Ignore hidden files
+            logging.info(f"Detected: {event.src_path}\n")
+            self.pipeline.submit(event.src_path)
+
+    def on_modified(self, event):
+        file_name = event.src_path.split('/')[-1]
+        if not event.is_directory and not file_name.startswith('.') and os.path.exists(event.src_path):
+            self.pipeline.submit(event.src_path)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            return
+        if event.src_path in self.pipeline.deleted_after_ingestion:
+            self.pipeline.deleted_after_ingestion.discard(event.src_path)
+            return
+        logging.info(f"Deleted: {event.src_path}\n")
+        self.pipeline.submit_delete(event.src_path)
@@ -0,0 +1,98 @@
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+# Terms found in more than this share of the chunks are treated as stopwords,
+# so common words do not force a scan of most of the index. Small indexes are always searched with every term.
+MAX_TERM_DOCUMENT_RATIO = 0.2
+MIN_CHUNKS_FOR_STOPWORDS = 1000
+
+# SQLite FTS5 full text index kept next to a Chroma collection.
+# Chunk ids are mapped to FTS rowids, so lookups and deletes by id stay indexed.
+class LexicalIndex:
+    def __init__(self, database_folder, collection_name):
+        folder = os.path.join(database_folder, "lexical")
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, f"{collection_name}.sqlite3")
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS chunk_ids (rowid INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE NOT NULL)")
+            # remove_diacritics folds č, š, ž so queries typed without them still match
+            self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(content, tokenize='unicode61 remove_diacritics 2')")
+            self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_vocab USING fts5vocab(chunks, row)")
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM chunk_ids").fetchone()[0]
+
+    def add(self, ids, texts):
+        with self.lock, self.connection:
+            for chunk_id, text in zip(ids, texts):
+                row = self.connection.execute("SELECT rowid FROM chunk_ids WHERE chunk_id = ?", (chunk_id,)).fetchone()
+                if row:
+                    self.connection.execute("DELETE FROM chunks WHERE rowid = ?", (row[0],))
+                    rowid = row[0]
+                else:
+                    rowid = self.connection.execute("INSERT INTO chunk_ids (chunk_id) VALUES (?)", (chunk_id,)).lastrowid
+                self.connection.execute("INSERT INTO chunks (rowid, content) VALUES (?, ?)", (rowid, text))
+
+    def delete(self, ids):
+        with self.lock, self.connection:
+            for chunk_id in ids:
+                row = self.connection.execute("SELECT rowid FROM chunk_ids WHERE chunk_id = ?", (chunk_id,)).fetchone()
+                if row:
+                    self.connection.execute("DELETE FROM chunks WHERE rowid = ?", (row[0],))
+                    self.connection.execute("DELETE FROM chunk_ids WHERE rowid = ?", (row[0],))
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM chunks")
+            self.connection.execute("DELETE FROM chunk_ids")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def drop(self):
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    # Returns a list of (chunk_id, score) tuples, best match first
+    def search(self, query, k):
+        terms = list(dict.fromkeys(re.findall(r"\w+", query.lower())))
+        if not terms:
+            return []
+
+        with self.lock:
+            total = self.connection.execute("SELECT MAX(rowid) FROM chunk_ids").fetchone()[0] or 0
+            if total >= MIN_CHUNKS_FOR_STOPWORDS:
+                # Look up how many chunks contain each term and skip the stopword-like ones
+                placeholders = ",".join("?" * len(terms))
+                frequencies = dict(self.connection.execute(
+                    f"SELECT term, doc FROM chunks_vocab WHERE term IN ({placeholders})",
+                    [self._fold(term) for term in terms],
+                ).fetchall())
+                terms = [term for term in terms if frequencies.get(self._fold(term), 0) <= total * MAX_TERM_DOCUMENT_RATIO]
+                if not terms:
+                    return []
+
+            match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+            rows = self.connection.execute(
+                "SELECT chunk_ids.chunk_id, bm25(chunks) FROM chunks JOIN chunk_ids ON chunk_ids.rowid = chunks.rowid "
+                "WHERE chunks MATCH ? ORDER BY bm25(chunks) LIMIT ?",
+                (match, k),
+            ).fetchall()
+        # bm25() is lower for better matches, flip it so higher is better
+        return [(chunk_id, -score) for chunk_id, score in rows]
+
+    # Fold a term the same way the FTS tokenizer does, so it can be looked up in the vocabulary
+    @staticmethod
+    def _fold(term):
+        decomposed = unicodedata.normalize("NFKD", term)
+        return "".join(c for c in decomposed if not unicodedata.combining(c))
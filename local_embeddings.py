@@ -0,0 +1,63 @@
+import logging
+import os
+import threading
+import time
+from langchain_core.embeddings import Embeddings
+
+import metrics as mt
+
+# In-process ONNX embedding model on top of fastembed, runs on the CPU next to the app
+# instead of queueing behind generation in Ollama.
+# The model is loaded on first use, fastembed is only imported then.
+class LocalEmbeddings(Embeddings):
+    def __init__(self, model, batch_size=32, threads=None, dimensions=None, cache_dir=None):
+        self.model_name = model
+        self.batch_size = batch_size
+        # Leave half of the cores to the rest of the app by default
+        self.threads = threads or max(1, (os.cpu_count() or 2) // 2)
+        self.dimensions = dimensions
+        self.cache_dir = cache_dir
+
+        self.model = None
+        self.load_lock = threading.Lock()
+
+        # Totals over the life of the model, for throughput reporting
+        self.lock = threading.Lock()
+        self.embedded = 0
+        self.seconds = 0.0
+
+    def load_model(self):
+        with self.load_lock:
+            if self.model is None:
+                from fastembed import TextEmbedding
+                self.model = TextEmbedding(model_name=self.model_name, threads=self.threads, cache_dir=self.cache_dir)
+        return self.model
+
+    def check_dimensions(self, vector):
+        if self.dimensions and len(vector) != self.dimensions:
+            raise ValueError(f"Embedding model {self.model_name} returns {len(vector)} dimensions, embedding_options.dimensions is {self.dimensions}")
+        return vector
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        model = self.load_model()
+        start = time.perf_counter()
+        with mt.span("embed_request"):
+            vectors = [self.check_dimensions(vector.tolist()) for vector in model.passage_embed(texts, batch_size=self.batch_size)]
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self.embedded += len(texts)
+            self.seconds += elapsed
+        logging.info(f"Embedded {len(texts)} chunks in {elapsed:.1f}s ({len(texts) / max(elapsed, 1e-9):.1f} chunks/sec)")
+        return vectors
+
+    def embed_query(self, text):
+        model = self.load_model()
+        with mt.span("embed_request"):
+            return self.check_dimensions(next(iter(model.query_embed(text))).tolist())
+
+    def throughput(self):
+        with self.lock:
+            return self.embedded / self.seconds if self.seconds else 0.0
@@ -0,0 +1,98 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+COUNTER_HELP = {
+    "rag_cache_requests_total": "Cache lookups by cache and result.",
+    "rag_documents_ingested_total": "Files ingested, by result.",
+    "rag_chunks_embedded_total": "Chunks embedded and stored.",
+    "rag_tokens_generated_total": "Tokens generated by the model.",
+    "rag_questions_total": "Questions answered.",
+    "rag_article_lookups_total": "Questions answered from the article named in them, without a search.",
+}
+
+# Timings of the current request, set by collect_timings()
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+# In-process latency histograms per stage and counters, rendered in the Prometheus text format
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # stage -> [bucket counts, sum, count]
+        self.counters = {}  # (name, sorted label items) -> value
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.setdefault(stage, [[0] * len(BUCKETS), 0.0, 0])
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+        timings = current_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines.append("# HELP rag_stage_duration_seconds Time spent in each stage of answering and ingestion.")
+            lines.append("# TYPE rag_stage_duration_seconds histogram")
+            for stage, (buckets, total, count) in sorted(self.histograms.items()):
+                for bound, bucket_count in zip(BUCKETS, buckets):
+                    lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {bucket_count}')
+                lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {total}')
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# HELP {name} {COUNTER_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name != name:
+                        continue
+                    label_text = ",".join(f'{key}="{value_}"' for key, value_ in labels)
+                    lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+registry = Metrics()
+
+def span(stage):
+    return registry.span(stage)
+
+def observe(stage, seconds):
+    registry.observe(stage, seconds)
+
+def increment(name, amount=1, **labels):
+    registry.increment(name, amount, **labels)
+
+def render():
+    return registry.render()
+
+# Collect the stage timings of one request, yields a dict of stage -> seconds that is filled as stages finish
+@contextmanager
+def collect_timings():
+    timings = {}
+    token = current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        current_timings.reset(token)
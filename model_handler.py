@@ -1,17 +1,20 @@
 # Ollama related
-import sys
+import time
 import requests
-import json
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import HumanMessage
 from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
 from langchain_ollama.chat_models import ChatOllama
-from langchain.callbacks.base import BaseCallbackHandler
+
+import context_packer as cp
+import conversation_memory as cm
+import metrics as mt
 
 class ModelHandler:
     def __init__(self, config):
         self.config = config
         
         self.model = self.load_model()
+        self.context_packer = cp.ContextPacker(self.config)
         
         self.prompt_template = PromptTemplate(
             input_variables=["context", "user_input"],
@@ -24,9 +27,22 @@ class ModelHandler:
             ("human", "{current_question}")
         ])
 
-        self.conversation_history = []
+        self.summary_prompt = PromptTemplate(
+            input_variables=["summary", "conversation"],
+            template=self.config["llm_options"]["summary_prompt"]
+        )
+
+        self.conversation_history = self.new_conversation()
+
+    # Empty short-term memory for a conversation, like one per web session
+    def new_conversation(self):
+        return cm.ConversationMemory(
+            self.context_packer.count_tokens,
+            max_tokens=self.config["llm_options"].get("history_max_tokens", 4096),
+            keep_turns=self.config["llm_options"].get("history_keep_turns", 2),
+        )
     
-    # Load the Ollama model
+    # Create the chat model, checking once that Ollama has it
     def load_model(self):
         try:
             return ChatOllama(
@@ -40,16 +56,25 @@ class ModelHandler:
             print(f"Error loading model: {e}\n Make sure you have installed the model and ollama is running")
             exit(1)
 
-    # Combine the contents of related documents into a single context string
+    # Have Ollama load the model into memory, so the first answer does not wait for it
+    def warm_up(self):
+        requests.post(
+            self.config["llm_options"]["ollama_address"].rstrip("/") + "/api/generate",
+            json={"model": self.config["llm_options"]["model"]},
+            timeout=300,
+        ).raise_for_status()
+
+    # Combine the contents of related documents into a single context string,
+    # without duplicates and overlapping text and within the context token budget
     def combine_context(self, related_docs):
-        context = ""
-        for result in related_docs:
-            # Add the content of each document part to the context
-            context += result.page_content+"\n"
+        context, _ = self.context_packer.pack(related_docs)
         return context
 
-    # Get response from the model
-    def get_response(self, user_input, related_docs, useRAG=False):
+    # Build the chat messages for a question: the system prompt, the conversation memory and the question with its context.
+    # Pass conversation_history to keep a separate history, like one per web session.
+    def prepare_messages(self, user_input, related_docs, useRAG=False, conversation_history=None):
+        if conversation_history is None:
+            conversation_history = self.conversation_history
         if useRAG:
             # Combine the contents of the related document parts into a single context string
             context = self.combine_context(related_docs)
@@ -59,32 +84,63 @@ class ModelHandler:
 
         # Format messages for the chat model
         formatted_messages = self.chat_prompt.format_messages(
-            conversation=self.config["llm_options"]["use_short_term_memory"] and self.conversation_history or [],
+            conversation=conversation_history.messages() if self.config["llm_options"]["use_short_term_memory"] else [],
             current_question=prompt,
         )
+        return prompt, formatted_messages
 
-        if self.config["llm_options"]["use_short_term_memory"]:
-            if sys.getsizeof(formatted_messages) > self.config["llm_options"]["max_context_size"]:
-                print("Warning: The conversation history is too large. Deleteing oldest messages to fit the context size.")
-                
-                self.conversation_history = self.conversation_history[1:] # Remove the oldest message
+    # If short-term memory is enabled, store the question and the answer,
+    # folding the oldest turns into the summary once the memory is over its token budget
+    def remember(self, user_input, response, conversation_history=None):
+        if conversation_history is None:
+            conversation_history = self.conversation_history
+        if not self.config["llm_options"]["use_short_term_memory"]:
+            return
+        conversation_history.add(user_input, response)
 
-                # Reformat messages after trimming history
-                formatted_messages = self.chat_prompt.format_messages(
-                    conversation=self.conversation_history,
-                    current_question=prompt,
-                )
+        turns = conversation_history.turns_to_compact()
+        if turns:
+            conversation = "\n".join(f"{message.type}: {message.content}" for question, answer, _ in turns for message in (question, answer))
+            with mt.span("history_compaction"):
+                summary = self.model.invoke([HumanMessage(content=self.summary_prompt.format(
+                    summary=conversation_history.summary or "(none)", conversation=conversation,
+                ))])
+            conversation_history.compact(summary.content.strip(), len(turns))
+
+    # Get response from the model
+    def get_response(self, user_input, related_docs, useRAG=False, conversation_history=None):
+        with mt.span("build_prompt"):
+            _, formatted_messages = self.prepare_messages(user_input, related_docs, useRAG, conversation_history)
 
         # Get the response from the model
-        response = self.model.invoke(formatted_messages)
+        with mt.span("generation"):
+            response = self.model.invoke(formatted_messages)
+        self.record_generation(response)
+        self.remember(user_input, response, conversation_history)
+        return response
 
-        # If short-term memory is enabled, store the interaction
-        if self.config["llm_options"]["use_short_term_memory"]:
-            self.conversation_history.append(HumanMessage(content=prompt))
-            self.conversation_history.append(response)
+    # Stream the response from the model, yields message chunks as tokens arrive.
+    # The conversation history is only updated once the whole answer has been generated.
+    def stream_response(self, user_input, related_docs, useRAG=False, conversation_history=None):
+        with mt.span("build_prompt"):
+            _, formatted_messages = self.prepare_messages(user_input, related_docs, useRAG, conversation_history)
 
-            
+        response = None
+        start = time.perf_counter()
+        for chunk in self.model.stream(formatted_messages):
+            if response is None:
+                mt.observe("time_to_first_token", time.perf_counter() - start)
+            response = chunk if response is None else response + chunk
+            yield chunk
+        mt.observe("generation", time.perf_counter() - start)
 
-        
+        if response is not None:
+            self.record_generation(response)
+            self.remember(user_input, response, conversation_history)
 
-        return response
\ No newline at end of file
+    # Count the answer and the generated tokens reported by Ollama
+    def record_generation(self, response):
+        mt.increment("rag_questions_total")
+        tokens = (getattr(response, "usage_metadata", None) or {}).get("output_tokens") or response.response_metadata.get("eval_count")
+        if tokens:
+            mt.increment("rag_tokens_generated_total", tokens)
@@ -0,0 +1,70 @@
+import logging
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from langchain_core.embeddings import Embeddings
+
+import metrics as mt
+
+# Ollama embedding client that splits texts into batches and sends them concurrently
+# over a pool of keep-alive connections, retrying failed batches
+class BatchedOllamaEmbeddings(Embeddings):
+    def __init__(self, model, base_url, batch_size=32, concurrency=4, retries=3, timeout=120, dimensions=None):
+        self.model = model
+        self.url = base_url.rstrip("/") + "/api/embed"
+        self.batch_size = batch_size
+        self.retries = retries
+        self.timeout = timeout
+        self.dimensions = dimensions
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed")
+
+        # Totals over the life of the client, for throughput reporting
+        self.lock = threading.Lock()
+        self.embedded = 0
+        self.seconds = 0.0
+
+    def embed_batch(self, texts):
+        for attempt in range(self.retries + 1):
+            try:
+                with mt.span("embed_request"):
+                    response = self.session.post(self.url, json={"model": self.model, "input": texts}, timeout=self.timeout)
+                response.raise_for_status()
+                embeddings = response.json()["embeddings"]
+                break
+            except (requests.RequestException, KeyError) as e:
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Embedding batch of {len(texts)} failed ({e}), retrying...")
+                time.sleep(2 ** attempt)
+        for vector in embeddings:
+            if self.dimensions and len(vector) != self.dimensions:
+                raise ValueError(f"Embedding model {self.model} returns {len(vector)} dimensions, embedding_options.dimensions is {self.dimensions}")
+        return embeddings
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        start = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = list(self.executor.map(self.embed_batch, batches))
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self.embedded += len(texts)
+            self.seconds += elapsed
+        logging.info(f"Embedded {len(texts)} chunks in {elapsed:.1f}s ({len(texts) / max(elapsed, 1e-9):.1f} chunks/sec)")
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text):
+        return self.embed_batch([text])[0]
+
+    def throughput(self):
+        with self.lock:
+            return self.embedded / self.seconds if self.seconds else 0.0
@@ -0,0 +1,198 @@
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Deterministic embedding of a text: hashed bag of words, normalized.
+# Texts sharing words get similar vectors, so retrieval over a synthetic corpus behaves like the real thing.
+def stub_embedding(text, dimensions):
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector))
+    if not norm:
+        vector[0] = 1.0
+        return vector
+    return [value / norm for value in vector]
+
+# Local stand-in for the parts of the Ollama API this project uses: model listing, embeddings, chat and warm-up.
+# Latencies are simulated per request, per embedded text and per generated token.
+class OllamaStub:
+    def __init__(self, host="127.0.0.1", port=0, dimensions=1024, embed_latency_ms=0, embed_item_latency_ms=0,
+                 chat_latency_ms=0, token_latency_ms=0, answer_tokens=64, models=()):
+        self.dimensions = dimensions
+        self.embed_latency_ms = embed_latency_ms
+        self.embed_item_latency_ms = embed_item_latency_ms
+        self.chat_latency_ms = chat_latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.answer_tokens = answer_tokens
+        # Models reported as installed, next to the stub's own
+        self.models = set(models)
+
+        self.lock = threading.Lock()
+        self.requests = {}
+
+        stub = self
+        class Handler(StubRequestHandler):
+            server_stub = stub
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count_request(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def request_counts(self):
+        with self.lock:
+            return dict(self.requests)
+
+    def sleep(self, milliseconds):
+        if milliseconds > 0:
+            time.sleep(milliseconds / 1000)
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    server_stub = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        stub = self.server_stub
+        stub.count_request(self.path)
+        if self.path == "/api/tags":
+            names = sorted(stub.models | {"stub:latest"})
+            self.send_json({"models": [{"name": name, "model": name, "modified_at": now(), "size": 0, "digest": "", "details": {}} for name in names]})
+        elif self.path == "/api/version":
+            self.send_json({"version": "0.0.0-stub"})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        stub = self.server_stub
+        stub.count_request(self.path)
+        payload = self.read_json()
+        if self.path in ("/api/embed", "/api/embeddings"):
+            self.embed(payload)
+        elif self.path == "/api/chat":
+            self.chat(payload)
+        elif self.path == "/api/generate":
+            self.send_json({"model": payload.get("model"), "created_at": now(), "response": "", "done": True, "done_reason": "load"})
+        elif self.path == "/api/show":
+            self.send_json({"modelfile": "", "parameters": "", "template": "", "details": {}, "model_info": {}})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def embed(self, payload):
+        stub = self.server_stub
+        texts = payload.get("input", payload.get("prompt", ""))
+        if isinstance(texts, str):
+            texts = [texts]
+        stub.sleep(stub.embed_latency_ms + stub.embed_item_latency_ms * len(texts))
+        embeddings = [stub_embedding(text, stub.dimensions) for text in texts]
+        if self.path == "/api/embeddings":
+            self.send_json({"embedding": embeddings[0]})
+        else:
+            self.send_json({"model": payload.get("model"), "embeddings": embeddings})
+
+    def chat(self, payload):
+        stub = self.server_stub
+        messages = payload.get("messages", [])
+        prompt_words = sum(len(str(message.get("content", "")).split()) for message in messages)
+        tokens = [f"token{i} " for i in range(stub.answer_tokens)]
+        started = time.perf_counter_ns()
+        stub.sleep(stub.chat_latency_ms)
+
+        def final_message(content):
+            return {
+                "model": payload.get("model"), "created_at": now(),
+                "message": {"role": "assistant", "content": content},
+                "done": True, "done_reason": "stop",
+                "total_duration": time.perf_counter_ns() - started, "load_duration": 0,
+                "prompt_eval_count": prompt_words, "prompt_eval_duration": 0,
+                "eval_count": len(tokens), "eval_duration": 0,
+            }
+
+        if not payload.get("stream", True):
+            stub.sleep(stub.token_latency_ms * len(tokens))
+            self.send_json(final_message("".join(tokens)))
+            return
+
+        # Newline delimited JSON, one message per token, like Ollama
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            stub.sleep(stub.token_latency_ms)
+            self.write_chunk({"model": payload.get("model"), "created_at": now(), "message": {"role": "assistant", "content": token}, "done": False})
+        self.write_chunk(final_message(""))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, payload):
+        line = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(line):X}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Ollama API.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dimensions", type=int, default=1024)
+    parser.add_argument("--embed-latency-ms", type=float, default=0)
+    parser.add_argument("--embed-item-latency-ms", type=float, default=0)
+    parser.add_argument("--chat-latency-ms", type=float, default=0)
+    parser.add_argument("--token-latency-ms", type=float, default=0)
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--model", action="append", default=[], help="Model to report as installed, can be repeated.")
+    args = parser.parse_args()
+
+    stub = OllamaStub(args.host, args.port, args.dimensions, args.embed_latency_ms, args.embed_item_latency_ms,
+                      args.chat_latency_ms, args.token_latency_ms, args.answer_tokens, args.model)
+    print(f"Ollama stand-in listening on {stub.address}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
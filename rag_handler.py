@@ -1,42 +1,258 @@
 # For document loading, splitting, storing
-from langchain_community.embeddings import FastEmbedEmbeddings
-from langchain_ollama import OllamaEmbeddings
+# Document loaders are imported when the first document is loaded, they are slow to import
 from langchain_core.documents import Document
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, csv_loader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_compressors import FlashrankRerank
-from chromadb.utils.embedding_functions import OllamaEmbeddingFunction;
-from flashrank import Ranker 
 
 from langchain_chroma import Chroma
 import chromadb
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import embedding_cache as ec
+import ingest_manifest as im
+import lexical_index as li
+import local_embeddings as le
+import metrics as mt
+import ollama_embeddings as oe
+import reranker as rr
+
+# Merge ranked lists of documents, each document scores 1 / (k + rank) in every list it appears in.
+# Documents are the same when their key is, their id by default.
+def reciprocal_rank_fusion(result_lists, k=60, key=lambda doc: doc.id):
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            scores[key(doc)] = scores.get(key(doc), 0) + 1 / (k + rank + 1)
+            docs.setdefault(key(doc), doc)
+    return sorted(docs.values(), key=lambda doc: scores[key(doc)], reverse=True)
+
+# A question naming one article: "23. člen", "člen 23", "article 23"
+ARTICLE_REFERENCE = re.compile(r"\b(\d{1,4})\.\s*člen|\bčlen\w*\s+(?:št\.\s*)?(\d{1,4})\b|\barticle\s+(\d{1,4})\b", re.IGNORECASE)
+
+# Earlier numbers of a list like "23. in 24. člen"
+ARTICLE_LIST = re.compile(r"\b(\d{1,4})\.\s*(?:,|in|ali|do|-)\s*(?=\d{1,4}\.)", re.IGNORECASE)
+
+# A list or range of numbers after the word: "členi 23 do 25", "article 23 and 24", "člen 23, 24"
+ARTICLE_LIST_AFTER = re.compile(r"\b(?:člen\w*|articles?)\s+(?:št\.\s*)?\d{1,4}\.?\s*(?:,|in|ali|do|-|–|and|or|to)\s*\d", re.IGNORECASE)
+
+# Returns the article number named in the query, or None if it names none or several
+def find_article_reference(query):
+    if ARTICLE_LIST_AFTER.search(query):
+        return None
+    numbers = {next(group for group in match.groups() if group) for match in ARTICLE_REFERENCE.finditer(query)}
+    numbers.update(match.group(1) for match in ARTICLE_LIST.finditer(query))
+    return numbers.pop() if len(numbers) == 1 else None
+
+# Chunks of an article from get_article_chunks() that answer the query: all of them if they come from one law,
+# those of the law the query names ("23. člen ZDR-1" for zdr-1.txt) otherwise, or none if it is ambiguous
+def article_chunks_for_query(query, docs):
+    sources = {doc.metadata.get("source_file", "") for doc in docs}
+    if len(sources) <= 1:
+        return docs
+    named = [source for source in sources if source and re.search(rf"(?<![\w-]){re.escape(source.rsplit('.', 1)[0])}(?![\w-])", query, re.IGNORECASE)]
+    if len(named) != 1:
+        return []
+    return [doc for doc in docs if doc.metadata.get("source_file") == named[0]]
+
+# Where filter for the chunks of a source stored before the manifest. ingest_txt.py used to store the path as typed
+# as the source and the lower case file name, which is the source now, as source_file.
+def legacy_source_filter(source):
+    return {"$or": [{"source": source}, {"source_file": source}]}
+
+def create_text_splitter(config):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=config["splitter_options"]["chunk_size"],
+        chunk_overlap=config["splitter_options"]["chunk_overlap"],
+    )
+
+# Create the embedding backend chosen in embedding_options: "ollama" sends texts to the Ollama server,
+# "fastembed" runs an ONNX model in this process
+def create_embeddings(config):
+    embedding_options = config.get("embedding_options", {})
+    backend = embedding_options.get("backend", "ollama")
+    if backend == "ollama":
+        return oe.BatchedOllamaEmbeddings(
+            model=embedding_options.get("model", "bge-m3"),
+            base_url=config["llm_options"]["ollama_address"],
+            batch_size=embedding_options.get("batch_size", 32),
+            concurrency=embedding_options.get("concurrency", 4),
+            retries=embedding_options.get("retries", 3),
+            timeout=embedding_options.get("timeout", 120),
+            dimensions=embedding_options.get("dimensions"),
+        )
+    if backend == "fastembed":
+        return le.LocalEmbeddings(
+            model=embedding_options.get("model", "BAAI/bge-small-en-v1.5"),
+            batch_size=embedding_options.get("batch_size", 32),
+            threads=embedding_options.get("threads"),
+            dimensions=embedding_options.get("dimensions"),
+            cache_dir=embedding_options.get("model_folder"),
+        )
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+# Name of the embedding model including its backend, vectors of different models must not be mixed
+def embedding_model_name(config):
+    embedding_options = config.get("embedding_options", {})
+    backend = embedding_options.get("backend", "ollama")
+    default_model = "bge-m3" if backend == "ollama" else "BAAI/bge-small-en-v1.5"
+    return f"{backend}:{embedding_options.get('model', default_model)}"
+
+# HNSW index settings of a new collection from index_options, with per collection overrides in index_options.collections.
+# Chroma fixes space, construction_ef and M when the collection is created.
+def index_metadata(config, collection_name):
+    options = dict(config.get("index_options", {}))
+    options.update(options.pop("collections", {}).get(collection_name, {}))
+    return {f"hnsw:{key}": value for key, value in options.items() if value is not None}
+
+# Load the document based on the file extension.
+# Kept at module level so ingestion worker processes can call it without a RAGHandler.
+def load_document(file_path):
+    from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, csv_loader, TextLoader
+    loader = None
+    if file_path.endswith(".pdf"):
+        loader = PyPDFLoader(file_path)
+    elif file_path.endswith(".docx"):
+        loader = Docx2txtLoader(file_path)
+    elif file_path.endswith(".csv"):
+        loader = csv_loader.CSVLoader(file_path)
+    elif file_path.endswith(".txt"):
+        loader = TextLoader(file_path)
+    else:
+        print("Unsupported file type")
+        return None
+    return loader.load()
+
+# Number of pages of a PDF, the pages themselves are not parsed
+def count_pdf_pages(file_path):
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+# Load a range of pages of a PDF, one Document per page like PyPDFLoader.
+# Ranges of one file can be loaded in parallel by worker processes.
+def load_pdf_pages(file_path, start, end):
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [
+        Document(page_content=reader.pages[page].extract_text(), metadata={"source": file_path, "page": page})
+        for page in range(start, min(end, len(reader.pages)))
+    ]
+
+# Read a CSV file in batches of rows, one Document per row like CSVLoader, without loading the whole file
+def iter_csv_documents(file_path, batch_size=1000):
+    import csv
+    with open(file_path, newline="", encoding="utf-8") as csv_file:
+        batch = []
+        for row_number, row in enumerate(csv.DictReader(csv_file)):
+            content = "\n".join(
+                f"{key.strip() if key is not None else key}: {value.strip() if isinstance(value, str) else ','.join(map(str.strip, value)) if isinstance(value, list) else value}"
+                for key, value in row.items()
+            )
+            batch.append(Document(page_content=content, metadata={"source": file_path, "row": row_number}))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
 class RAGHandler:
-    def __init__(self, config):
+    def __init__(self, config, collection_name=None):
         self.config = config
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.config["splitter_options"]["chunk_size"],
-            chunk_overlap=self.config["splitter_options"]["chunk_overlap"],
-        )
-        self.vector_store = self.initialize_chroma(self.config["rag_options"]["collection_name"])
-        self.reranker = FlashrankRerank(
-            score_threshold = self.config["rag_options"]["similarity_threshold"],
-            top_n=self.config["rag_options"]["results_to_return"],
-            model="ms-marco-MiniLM-L-12-v2",
+        self.text_splitter = create_text_splitter(self.config)
+        self.embedding_model = embedding_model_name(self.config)
+        self.embeddings = create_embeddings(self.config)
+        # Kept apart from the query cache wrapper, for throughput reporting
+        self.document_embeddings = self.embeddings
+        cache_options = self.config.get("cache_options", {})
+        if cache_options.get("embedding_cache", False):
+            self.embeddings = ec.CachedEmbeddings(
+                self.embeddings,
+                model_name=self.embedding_model,
+                database_folder=self.config["rag_options"]["database_folder"],
+                max_entries=cache_options.get("embedding_cache_size", 50000),
+                memory_entries=cache_options.get("embedding_memory_cache_size", 1024),
+            )
+        # Open vector stores by collection name, so collection handles are reused between calls
+        # and shared between threads serving different collections
+        self.vector_stores = {}
+        self.stores_lock = threading.RLock()
+        self.lexical_indexes = {}
+        self.manifest = im.IngestManifest(self.config["rag_options"]["database_folder"])
+        self.client = chromadb.PersistentClient(
+            path=self.config["rag_options"]["database_folder"],
+            settings=chromadb.config.Settings(anonymized_telemetry=False),
         )
+        self.vector_store = self.initialize_chroma(collection_name or self.config["rag_options"]["collection_name"])
+        # The reranker model is only loaded when the first results are reranked
+        self.reranker = rr.Reranker(self.config)
+        # Searches several collections at once in federated mode
+        self.search_executor = ThreadPoolExecutor(max_workers=self.config["rag_options"].get("search_workers", 8), thread_name_prefix="search")
 
     def initialize_chroma(self, collection_name):
-        return Chroma(
-            collection_name=collection_name,
-            persist_directory=self.config["rag_options"]["database_folder"],
-            #embedding_function=FastEmbedEmbeddings(),
-            #embedding_function=OllamaEmbeddings(model="nomic-embed-text",base_url=self.config["llm_options"]["ollama_address"]),
-            embedding_function=OllamaEmbeddings(model="bge-m3",base_url=self.config["llm_options"]["ollama_address"]),
-            client_settings=chromadb.config.Settings(
-                anonymized_telemetry=False,
-            ),
-        )
-    
+        with self.stores_lock:
+            if collection_name not in self.vector_stores:
+                self.check_embedding_model(collection_name)
+                exists = collection_name in [coll.name for coll in self.client.list_collections()]
+                self.vector_stores[collection_name] = Chroma(
+                    client=self.client,
+                    collection_name=collection_name,
+                    embedding_function=self.embeddings,
+                    collection_metadata=None if exists else index_metadata(self.config, collection_name),
+                )
+                if exists:
+                    self.check_index_settings(self.vector_stores[collection_name]._collection)
+                # Collections filled before models were recorded are assumed to use the configured model
+                if self.manifest.get_embedding_model(collection_name) is None and self.vector_stores[collection_name]._collection.count() > 0:
+                    print(f"Warning: Collection {collection_name} has no recorded embedding model, assuming {self.embedding_model}")
+                    self.manifest.set_embedding_model(collection_name, self.embedding_model)
+            return self.vector_stores[collection_name]
+
+    # Refuse to open a collection embedded with another model than the configured one,
+    # its vectors cannot be compared with the ones of the configured model
+    def check_embedding_model(self, collection_name):
+        stored_model = self.manifest.get_embedding_model(collection_name)
+        if stored_model is not None and stored_model != self.embedding_model:
+            raise ValueError(
+                f"Collection {collection_name} was embedded with {stored_model}, but embedding_options select {self.embedding_model}. "
+                f"Change embedding_options back or ingest into another collection."
+            )
+
+    # Existing collections keep the index they were created with, only search_ef can still be changed
+    def check_index_settings(self, collection):
+        wanted = index_metadata(self.config, collection.name)
+        metadata = collection.metadata or {}
+        fixed = [key for key in ("hnsw:space", "hnsw:construction_ef", "hnsw:M") if key in wanted and metadata.get(key, wanted[key]) != wanted[key]]
+        if "hnsw:space" in wanted and "hnsw:space" not in metadata and wanted["hnsw:space"] != "l2":
+            fixed.append("hnsw:space")
+        if fixed:
+            print(f"Warning: Collection {collection.name} was created with other {', '.join(fixed)} settings, they only apply to new collections.")
+        # Chroma 1.x keeps the current search_ef in the collection configuration, the metadata keeps the one it was created with.
+        # Changing the metadata would send hnsw:space back to Chroma, which refuses it.
+        configuration = getattr(collection, "configuration", None) or {}
+        search_ef = (configuration.get("hnsw") or {}).get("ef_search", metadata.get("hnsw:search_ef"))
+        if "hnsw:search_ef" in wanted and search_ef != wanted["hnsw:search_ef"]:
+            try:
+                collection.modify(configuration={"hnsw": {"ef_search": wanted["hnsw:search_ef"]}})
+            except Exception as e:
+                print(f"Warning: Collection {collection.name} keeps search_ef {search_ef}, it could not be changed: {e}")
+
+    # Get the full text index of a collection, filling it from Chroma if the collection predates it
+    def get_lexical_index(self, collection_name=None):
+        collection_name = collection_name or self.vector_store._collection.name
+        with self.stores_lock:
+            if collection_name not in self.lexical_indexes:
+                index = li.LexicalIndex(self.config["rag_options"]["database_folder"], collection_name)
+                collection = self.initialize_chroma(collection_name)._collection
+                if index.count() == 0 and collection.count() > 0:
+                    print(f"Building full text index for collection: {collection_name}")
+                    batch_size = 5000
+                    for offset in range(0, collection.count(), batch_size):
+                        batch = collection.get(limit=batch_size, offset=offset, include=["documents"])
+                        index.add(batch["ids"], batch["documents"])
+                self.lexical_indexes[collection_name] = index
+            return self.lexical_indexes[collection_name]
+
     def list_collections(self):
         return self.vector_store._client.list_collections()
 
@@ -47,72 +263,249 @@ class RAGHandler:
         collections = self.vector_store._client.list_collections()
         if collection_name in [coll.name for coll in collections]:
             self.vector_store._client.delete_collection(collection_name)
+            self.vector_stores.pop(collection_name, None)
+        index = self.lexical_indexes.pop(collection_name, None) or li.LexicalIndex(self.config["rag_options"]["database_folder"], collection_name)
+        index.drop()
+        self.manifest.drop_collection(collection_name)
+
+    # Remove all documents from the active collection, it is created again with the configured index settings
+    def reset_collection(self):
+        collection_name = self.vector_store._collection.name
+        with self.stores_lock:
+            self.get_lexical_index(collection_name).clear()
+            self.client.delete_collection(collection_name)
+            self.vector_stores.pop(collection_name, None)
+            self.manifest.drop_collection(collection_name)
+            self.vector_store = self.initialize_chroma(collection_name)
 
-    # Load the document based on the file extension
     def load_document(self, file_path):
-        loader = None
-        if file_path.endswith(".pdf"):
-            loader = PyPDFLoader(file_path)
-        elif file_path.endswith(".docx"):
-            loader = Docx2txtLoader(file_path)
-        elif file_path.endswith(".csv"):
-            loader = csv_loader.CSVLoader(file_path)
-        elif file_path.endswith(".txt"):
-            loader = TextLoader(file_path)
-        else:
-            print("Unsupported file type")
-            return None
-        return loader.load()
-
-    def add_document_to_chroma(self, document):
+        return load_document(file_path)
+
+    # Get the vector store of a collection, the active one by default
+    def get_vector_store(self, collection_name=None):
+        return self.initialize_chroma(collection_name) if collection_name else self.vector_store
+
+    # Split the document and bring its source up to date: new chunks are embedded, stale ones removed
+    def add_document_to_chroma(self, document, source=None, collection_name=None):
         if document is None:
             print(f"Failed to load document.")
             return
+        if source is None:
+            source = document[0].metadata.get("source") if document else None
         chunks = self.text_splitter.split_documents(document)
-        self.vector_store.add_documents(chunks)
-        print(f"Added document to the database.")
-
-    def get_docs_by_similarity(self, query):
-        docs_and_scores = self.vector_store.similarity_search_with_relevance_scores(
-            query=query,
-            k=self.config["rag_options"]["results_to_return"],
-            score_threshold=self.config["rag_options"]["similarity_threshold"],
-        )
+        previous_ids = self.get_source_chunk_ids(source, collection_name)
+        ids = self.add_chunks_to_chroma(chunks, source, collection_name=collection_name)
+        removed = self.remove_stale_chunks(source, ids, previous_ids, collection_name)
+        print(f"Added document to the database. ({len(ids)} chunks, {removed} removed)")
 
-        # Extract only the documents from the (document, score) tuples
-        docs_only = objects = [x[0] for x in docs_and_scores]
+    # Chunk ids stored for a source, falling back to a metadata lookup for sources ingested before the manifest
+    def get_source_chunk_ids(self, source, collection_name=None):
+        vector_store = self.get_vector_store(collection_name)
+        ids = self.manifest.get_chunk_ids(vector_store._collection.name, source)
+        if not ids:
+            ids = set(vector_store._collection.get(where=legacy_source_filter(source), include=[])["ids"])
+        return ids
 
-        # 2. do a full text query to get metadata (like source file names)
-        collection = self.vector_store._client.get_collection(
-            name=self.config["rag_options"]["collection_name"],
-            embedding_function=OllamaEmbeddingFunction(
-                model_name="bge-m3",
-                url=self.config["llm_options"]["ollama_address"]
-            ),
-        )
+    # Store already split chunks of one source in a collection (the active one by default) and its full text index.
+    # Chunks that are already stored are not embedded again. Returns the ids of all given chunks.
+    # Pass ids to use chunk ids computed by the caller.
+    def add_chunks_to_chroma(self, chunks, source, occurrences=None, collection_name=None, ids=None):
+        vector_store = self.get_vector_store(collection_name)
+        collection_name = vector_store._collection.name
+        lexical_index = self.get_lexical_index(collection_name)
+        for chunk in chunks:
+            chunk.metadata["source"] = source
+        if ids is None:
+            ids = im.chunk_ids(source, chunks, occurrences)
+        # Stored chunk ids are recorded in the manifest, so only the given ids are looked up there
+        existing = self.manifest.find_chunk_ids(collection_name, source, ids)
 
-        fulltext_results = collection.query(
-            query_texts=[query],
-            where_document={"$contains": query},
-            #n_results=self.config["rag_options"]["results_to_return"] * 2,
-        )
+        new_chunks = [chunk for chunk_id, chunk in zip(ids, chunks) if chunk_id not in existing]
+        new_ids = [chunk_id for chunk_id in ids if chunk_id not in existing]
+        if new_chunks:
+            self.manifest.set_embedding_model(collection_name, self.embedding_model)
+            with mt.span("ingest_embed_store"):
+                vector_store.add_documents(new_chunks, ids=new_ids)
+            with mt.span("ingest_fulltext_index"):
+                lexical_index.add(new_ids, [chunk.page_content for chunk in new_chunks])
+            mt.increment("rag_chunks_embedded_total", len(new_chunks))
+
+        # Unchanged chunks keep their vectors, only their metadata (like page numbers) is refreshed
+        unchanged = [(chunk_id, chunk) for chunk_id, chunk in zip(ids, chunks) if chunk_id in existing]
+        if unchanged:
+            vector_store._collection.update(
+                ids=[chunk_id for chunk_id, _ in unchanged],
+                metadatas=[chunk.metadata for _, chunk in unchanged],
+            )
+
+        self.manifest.add_chunk_ids(collection_name, source, ids)
+        return ids
+
+    # Delete the chunks of a source that are not in keep_ids, returns the number of removed chunks.
+    # Pass previous_ids when they were read before new chunks of the source were added.
+    def remove_stale_chunks(self, source, keep_ids, previous_ids=None, collection_name=None):
+        vector_store = self.get_vector_store(collection_name)
+        collection_name = vector_store._collection.name
+        if previous_ids is None:
+            previous_ids = self.get_source_chunk_ids(source, collection_name)
+        stale = list((previous_ids | self.manifest.get_chunk_ids(collection_name, source)) - set(keep_ids))
+        return self.delete_chunks(source, stale, collection_name)
+
+    # Delete chunks of a source from the collection, its full text index and the manifest
+    def delete_chunks(self, source, ids, collection_name=None):
+        vector_store = self.get_vector_store(collection_name)
+        collection_name = vector_store._collection.name
+        if ids:
+            vector_store.delete(ids=ids)
+            self.get_lexical_index(collection_name).delete(ids)
+            self.manifest.remove_chunk_ids(collection_name, source, ids)
+        return len(ids)
+
+    # Delete all chunks of a source, used when its file is deleted
+    def remove_source(self, source, collection_name=None):
+        return self.remove_stale_chunks(source, [], collection_name=collection_name)
+
+    # Embed the query text, the vector is reused by every search for the same question
+    def embed_query(self, query):
+        return self.embeddings.embed_query(query)
+
+    # All chunks of an article by its number, in order, from chunks stored with article metadata by ingest_txt.py
+    def get_article_chunks(self, article_no, collection_name=None):
+        collection = self.get_vector_store(collection_name)._collection
+        results = collection.get(where={"clen": article_no}, include=["documents", "metadatas"])
+        docs = []
+        for i in range(len(results["ids"])):
+            docs.append(Document(page_content=results["documents"][i], metadata=results["metadatas"][i] or {}, id=results["ids"][i]))
+            docs[-1].metadata["collection"] = collection.name
+        return sorted(docs, key=lambda doc: (doc.metadata.get("source_file", ""), doc.metadata.get("del_clena", 0)))
+
+    # What a question is searched in, as a key for the answer cache: the given collection (the active one by default),
+    # or in federated mode the comma separated names of the searched collections
+    def search_scope(self, collection_name=None):
+        if self.config["rag_options"].get("federated_search", False):
+            return ",".join(self.federated_collections())
+        return collection_name or self.vector_store._collection.name
 
-        for i in range(len(fulltext_results["ids"][0])):
-            doc = fulltext_results["documents"][0][i]
-            new_doc = Document(page_content=doc, metadata=fulltext_results["metadatas"][0][i], id=fulltext_results["ids"][0][i])
+    # The collections searched in federated mode: rag_options.search_collections, or all of them if it is empty.
+    # Collections of another embedding model are left out.
+    def federated_collections(self):
+        names = self.config["rag_options"].get("search_collections") or sorted(coll.name for coll in self.list_collections())
+        usable = []
+        for name in names:
+            try:
+                self.get_vector_store(name)
+            except ValueError as e:
+                print(f"Warning: Not searching collection {name}: {e}")
+                continue
+            usable.append(name)
+        return usable
+
+    def has_documents(self, scope):
+        return any(self.get_vector_store(name)._collection.count() > 0 for name in scope.split(",") if name)
+
+    # Search the collections of a scope from search_scope()
+    def search(self, query, query_embedding=None, scope=None):
+        names = scope.split(",") if scope else [self.vector_store._collection.name]
+        if len(names) == 1:
+            return self.get_docs_by_similarity(query, query_embedding, names[0])
+        return self.get_docs_from_collections(query, query_embedding, names)
+
+    # Search several collections in parallel with one query embedding, then merge and rerank the results of all of them.
+    # Every result is tagged with its collection in the "collection" metadata.
+    def get_docs_from_collections(self, query, query_embedding=None, collection_names=None):
+        collection_names = collection_names or self.federated_collections()
+        if self.config["rag_options"].get("article_lookup", True):
+            article_no = find_article_reference(query)
+            if article_no:
+                with mt.span("article_lookup"):
+                    results = list(self.search_executor.map(lambda name: self.get_article_chunks(article_no, name), collection_names))
+                docs = article_chunks_for_query(query, [doc for collection_docs in results for doc in collection_docs])
+                if docs:
+                    mt.increment("rag_article_lookups_total")
+                    return docs
+
+        if query_embedding is None:
+            with mt.span("embed_query"):
+                query_embedding = self.embed_query(query)
+        with mt.span("federated_search"):
+            results = list(self.search_executor.map(lambda name: self.search_collection(query, query_embedding, name), collection_names))
+        # Ranks of the fused lists of different collections are comparable, scores are not.
+        # Chunk ids do not include the collection, the same file ingested or imported into two collections has the same ids.
+        docs_only = reciprocal_rank_fusion(results, k=self.config["rag_options"].get("rrf_k", 60), key=lambda doc: (doc.metadata["collection"], doc.id))
+        return self.rank(query, docs_only)
+
+    # Search a collection, the active one by default
+    def get_docs_by_similarity(self, query, query_embedding=None, collection_name=None):
+        # Questions about one article of one law get its chunks directly, without embedding or ranking anything
+        if self.config["rag_options"].get("article_lookup", True):
+            article_no = find_article_reference(query)
+            if article_no:
+                with mt.span("article_lookup"):
+                    docs = article_chunks_for_query(query, self.get_article_chunks(article_no, collection_name))
+                if docs:
+                    mt.increment("rag_article_lookups_total")
+                    return docs
+
+        if query_embedding is None:
+            with mt.span("embed_query"):
+                query_embedding = self.embed_query(query)
+        return self.rank(query, self.search_collection(query, query_embedding, collection_name))
+
+    # Vector and full text search of one collection, merged by reciprocal rank fusion but not reranked
+    def search_collection(self, query, query_embedding, collection_name=None):
+        vector_store = self.get_vector_store(collection_name)
+        collection = vector_store._collection
+        relevance_score_fn = vector_store._select_relevance_score_fn()
+
+        # 1. vector search with the precomputed query embedding
+        with mt.span("vector_search"):
+            vector_results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=self.config["rag_options"]["results_to_return"],
+                include=["documents", "metadatas", "distances"],
+            )
+
+        docs_only = []
+        for i in range(len(vector_results["ids"][0])):
+            score = relevance_score_fn(vector_results["distances"][0][i])
+            if score < self.config["rag_options"]["similarity_threshold"]:
+                continue
+            doc = vector_results["documents"][0][i]
+            new_doc = Document(page_content=doc, metadata=vector_results["metadatas"][0][i] or {}, id=vector_results["ids"][0][i])
             docs_only.append(new_doc)
 
+        # 2. do a full text query on the collection's lexical index
+        with mt.span("fulltext_search"):
+            fulltext_hits = self.get_lexical_index(collection.name).search(query, self.config["rag_options"]["results_to_return"])
+            fulltext_docs = []
+            if fulltext_hits:
+                fulltext_ids = [chunk_id for chunk_id, _ in fulltext_hits]
+                fulltext_results = collection.get(ids=fulltext_ids, include=["documents", "metadatas"])
+                found = {fulltext_results["ids"][i]: i for i in range(len(fulltext_results["ids"]))}
+                for chunk_id in fulltext_ids:
+                    if chunk_id not in found:
+                        continue
+                    i = found[chunk_id]
+                    new_doc = Document(page_content=fulltext_results["documents"][i], metadata=fulltext_results["metadatas"][i] or {}, id=chunk_id)
+                    fulltext_docs.append(new_doc)
+
         #for doc, score in docs_and_scores:
         #    print(f"Doc ID: {doc.metadata.get('source', 'N/A')}, Score: {score} Content:\n{doc.page_content[:200]}...\n")
 
-        #for r in fulltext_hits:
-        #    print(f"  {r['doc']} (fulltext_score: {r['fulltext_score']:.4f})")
-        
-        # If reranker is enabled, compress the documents
+        #for chunk_id, score in fulltext_hits:
+        #    print(f"  {chunk_id} (fulltext_score: {score:.4f})")
+
+        # 3. merge both result lists by reciprocal rank fusion
+        docs_only = reciprocal_rank_fusion([docs_only, fulltext_docs], k=self.config["rag_options"].get("rrf_k", 60))
+        for doc in docs_only:
+            doc.metadata["collection"] = collection.name
+        return docs_only
+
+    # Keep the best results_to_return documents
+    def rank(self, query, docs_only):
+        # If reranker is enabled, reorder the documents by the cross-encoder score
         if self.config["rag_options"].get("use_reranker", False) and len(docs_only) > 0:
-            self.reranker.compress_documents(
-                documents=docs_only,
-                query=query,
-            )
+            with mt.span("rerank"):
+                return self.reranker.rerank(query, docs_only, self.config["rag_options"]["results_to_return"])
 
         return docs_only[:self.config["rag_options"]["results_to_return"]]
\ No newline at end of file
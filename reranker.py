@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+
+import metrics as mt
+
+# Cross-encoder rerank stage on top of flashrank.
+# Candidates are scored in one batch, scores are cached per (query, chunk id) and the number of
+# candidates scored per call is capped by a latency budget measured from previous calls.
+class Reranker:
+    def __init__(self, config):
+        self.config = config
+        options = self.config.get("reranker_options", {})
+        self.model_name = options.get("model", "ms-marco-MiniLM-L-12-v2")
+        self.max_candidates = options.get("max_candidates", 20)
+        self.latency_budget_ms = options.get("latency_budget_ms", 0)
+        self.cache_size = options.get("cache_size", 10000)
+        self.score_threshold = options.get("score_threshold", self.config["rag_options"]["similarity_threshold"])
+
+        self.ranker = None
+        self.ms_per_candidate = None
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Load the model on first use, flashrank is only imported then
+    def load_model(self):
+        with self.lock:
+            if self.ranker is None:
+                from flashrank import Ranker
+                self.ranker = Ranker(model_name=self.model_name)
+        return self.ranker
+
+    def cache_key(self, query, doc):
+        return (query, doc.id or hash(doc.page_content))
+
+    def cache_get(self, key):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        return None
+
+    def cache_put(self, key, score):
+        with self.lock:
+            self.cache[key] = score
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    # How many uncached candidates can be scored within the latency budget
+    def affordable_candidates(self):
+        if not self.latency_budget_ms or not self.ms_per_candidate:
+            return self.max_candidates
+        return max(1, int(self.latency_budget_ms / self.ms_per_candidate))
+
+    # Score documents against the query, returns (document, score) tuples in input order
+    def score(self, query, docs):
+        if not docs:
+            return []
+        passages = [{"id": i, "text": doc.page_content} for i, doc in enumerate(docs)]
+        ranker = self.load_model()
+
+        start = time.perf_counter()
+        from flashrank import RerankRequest
+        results = ranker.rerank(RerankRequest(query=query, passages=passages))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        # Moving average of the cost per candidate, used to size the next batch
+        per_candidate = elapsed_ms / len(docs)
+        self.ms_per_candidate = per_candidate if self.ms_per_candidate is None else 0.8 * self.ms_per_candidate + 0.2 * per_candidate
+
+        scores = {result["id"]: float(result["score"]) for result in results}
+        return [(doc, scores[i]) for i, doc in enumerate(docs)]
+
+    # Rerank documents, drop the ones under the score threshold and return the top_n best.
+    # Candidates that did not fit into the latency budget keep their original order after the scored ones.
+    def rerank(self, query, docs, top_n):
+        candidates = docs[:self.max_candidates]
+
+        scored = []
+        uncached = []
+        for doc in candidates:
+            score = self.cache_get(self.cache_key(query, doc))
+            if score is None:
+                uncached.append(doc)
+            else:
+                scored.append((doc, score))
+        mt.increment("rag_cache_requests_total", len(scored), cache="rerank", result="hit")
+        mt.increment("rag_cache_requests_total", len(uncached), cache="rerank", result="miss")
+
+        affordable = self.affordable_candidates()
+        unscored = uncached[affordable:]
+        for doc, score in self.score(query, uncached[:affordable]):
+            self.cache_put(self.cache_key(query, doc), score)
+            scored.append((doc, score))
+
+        scored.sort(key=lambda x: x[1], reverse=True)
+        reranked = []
+        for doc, score in scored:
+            if score < self.score_threshold:
+                continue
+            doc.metadata["relevance_score"] = score
+            reranked.append(doc)
+
+        return (reranked + unscored)[:top_n]
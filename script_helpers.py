@@ -0,0 +1,26 @@
+import json
+import os
+
+# Helpers shared by the command line tools (benchmark.py, tune_index.py)
+
+# config.json with the overrides of config.local.json, if it exists
+def load_config():
+    with open("config.json", mode="r", encoding="utf-8") as read_file:
+        config = json.load(read_file)
+    if os.path.exists("config.local.json"):
+        with open("config.local.json", mode="r", encoding="utf-8") as read_file:
+            local_config = json.load(read_file)
+            for key, value in local_config.items():
+                if key in config and isinstance(config[key], dict) and isinstance(value, dict):
+                    config[key].update(value)
+                else:
+                    config[key] = value
+    return config
+
+# Nearest rank percentile, share between 0 and 1, None for no values
+def percentile(values, share):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(share * len(ordered) + 0.5)) - 1))
+    return ordered[index]
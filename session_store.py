@@ -0,0 +1,39 @@
+import threading
+import time
+import uuid
+
+# Per-user state of the web app: the selected collection and the conversation history.
+# Sessions are kept in memory by id and dropped after they have been idle for timeout seconds.
+class SessionStore:
+    def __init__(self, default_collection, timeout=3600, new_history=list):
+        self.default_collection = default_collection
+        self.new_history = new_history
+        self.timeout = timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    # Get the state of a session, creating it if it does not exist (anymore)
+    def get(self, session_id):
+        with self.lock:
+            now = time.monotonic()
+            self.expire(now)
+            state = self.sessions.get(session_id)
+            if state is None:
+                state = {"collection": self.default_collection, "history": self.new_history(), "lock": threading.Lock()}
+                self.sessions[session_id] = state
+            state["last_used"] = now
+            return state
+
+    def count(self):
+        with self.lock:
+            return len(self.sessions)
+
+    def expire(self, now):
+        if not self.timeout:
+            return
+        for session_id, state in list(self.sessions.items()):
+            if now - state["last_used"] > self.timeout:
+                del self.sessions[session_id]
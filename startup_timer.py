@@ -0,0 +1,44 @@
+import logging
+import threading
+import time
+
+# Measures how long each start-up phase takes.
+# mark() ends the phase running since the previous mark, record() adds a phase timed elsewhere,
+# like a model loaded by a background thread.
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last_mark = self.started
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        with self.lock:
+            self.phases.append((name, now - self.last_mark))
+            self.last_mark = now
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.phases.append((name, seconds))
+        logging.info(f"Startup: {name} took {seconds:.2f}s")
+
+    # Run a function in the background and record how long it took
+    def run_in_background(self, name, function):
+        def run():
+            start = time.perf_counter()
+            try:
+                function()
+            except Exception as e:
+                logging.warning(f"Startup: {name} failed: {e}")
+                return
+            self.record(name, time.perf_counter() - start)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def report(self):
+        with self.lock:
+            phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases)
+            total = self.last_mark - self.started
+        logging.info(f"Startup: ready in {total:.2f}s ({phases})")
@@ -0,0 +1,15 @@
+from context_packer import ContextPacker
+from custom_text_splitter import CustomTextSplitter
+
+def test_overlap_of_article_parts_is_cut_after_their_headers():
+    sentences = [f"({i}) delavec ima pravico do odmora med delovnim časom številka {i}." for i in range(1, 30)]
+    chunks = CustomTextSplitter(chunk_size=300, chunk_overlap=80).split_text_with_metadata("5. člen\n" + "\n".join(sentences) + "\n", "zdr-1.txt")
+    for chunk in chunks:
+        chunk.metadata["source"] = "zdr-1.txt"
+    assert len(chunks) > 2
+
+    context, taken = ContextPacker({"splitter_options": {"chunk_overlap": 80}}).pack(chunks)
+    assert taken == chunks
+    assert all(context.count(sentence) == 1 for sentence in sentences)
+    assert context.count("člen številka: 5\n") == len(chunks)
+    assert "člen številka: 5\ndel člena: 2\n\n(" in context
@@ -0,0 +1,99 @@
+from custom_text_splitter import CustomTextSplitter
+
+# Excerpts in the shape of the Slovenian laws ingest_txt.py is used for (ZDR-1, ZPIZ-2)
+LAW = """ZAKON O DELOVNIH RAZMERJIH (ZDR-1)
+
+I. poglavje SPLOŠNE DOLOČBE
+
+1. Vsebina zakona
+
+1. člen
+(vsebina zakona)
+Ta zakon ureja delovna razmerja, ki se sklenejo s pogodbo o zaposlitvi med delavcem in delodajalcem.
+
+2. Pojmi
+
+4. člen
+(pojem delovnega razmerja)
+(1) Delovno razmerje je razmerje med delavcem in delodajalcem, v katerem se delavec prostovoljno vključi v organiziran delovni proces delodajalca.
+(2) Delovno razmerje se sklene s pogodbo o zaposlitvi, ki jo skleneta:
+1. delodajalec, ki zaposluje več kot 20 delavcev, in
+2. delavec, ki izpolnjuje pogoje za zasedbo delovnega mesta.
+
+II. poglavje POGODBA O ZAPOSLITVI
+
+1. oddelek Sklenitev pogodbe o zaposlitvi
+
+14. člen
+(obvezno zavarovanje)
+Obvezno je zavarovan:
+3. zavarovanec
+2. v primeru iz prejšnjega odstavka
+pa tudi delavec, ki dela pri delodajalcu s sedežem v tujini.
+
+2. oddelek Veljavnost pogodbe
+
+15. člen
+(veljavnost)
+Pogodba o zaposlitvi začne veljati z dnem podpisa.
+"""
+
+def split(text, **kwargs):
+    return CustomTextSplitter(**kwargs).split_text_with_metadata(text, "zdr-1.txt")
+
+def chunks_of(chunks, clen):
+    return [chunk for chunk in chunks if chunk.metadata.get("clen") == clen]
+
+def test_numbered_points_of_an_article_stay_in_its_text():
+    chunks = split(LAW)
+    text = "\n".join(chunk.page_content for chunk in chunks_of(chunks, "4"))
+    assert "1. delodajalec, ki zaposluje več kot 20 delavcev, in" in text
+    assert "2. delavec, ki izpolnjuje pogoje za zasedbo delovnega mesta." in text
+
+    text = "\n".join(chunk.page_content for chunk in chunks_of(chunks, "14"))
+    assert "3. zavarovanec" in text
+    assert "2. v primeru iz prejšnjega odstavka" in text
+    assert all(chunk.metadata["oddelek"] == "1. oddelek Sklenitev pogodbe o zaposlitvi" for chunk in chunks_of(chunks, "14"))
+
+def test_section_titles_between_articles_are_metadata():
+    chunks = split(LAW)
+    assert chunks_of(chunks, "1")[0].metadata["oddelek"] == "1. Vsebina zakona"
+    # A numbered title right after the text of an article cannot be told from a point of it, so it is kept as text
+    assert "2. pojmi" in chunks_of(chunks, "1")[-1].page_content
+    assert chunks_of(chunks, "4")[0].metadata["oddelek"] == "1. Vsebina zakona"
+    assert chunks_of(chunks, "15")[0].metadata["oddelek"] == "2. oddelek Veljavnost pogodbe"
+    assert chunks_of(chunks, "15")[0].metadata["poglavje"] == "II. poglavje POGODBA O ZAPOSLITVI"
+    assert not any("vsebina zakona\n" in chunk.page_content for chunk in chunks)
+
+def test_chunks_start_with_the_article_and_part_number():
+    chunk = chunks_of(split(LAW), "15")[0]
+    assert chunk.page_content.startswith("člen številka: 15\ndel člena: 1\n\n")
+    assert chunk.metadata["original_text"].endswith("Pogodba o zaposlitvi začne veljati z dnem podpisa.")
+    assert chunk.metadata["source_file"] == "zdr-1.txt"
+
+def test_long_articles_are_cut_into_overlapping_parts():
+    sentences = [f"({i}) Delavec ima pravico do odmora med delovnim časom številka {i}." for i in range(1, 30)]
+    text = "5. člen\n" + "\n".join(sentences) + "\n"
+    chunks = split(text, chunk_size=300, chunk_overlap=80)
+    assert len(chunks) > 1
+    assert [chunk.metadata["del_clena"] for chunk in chunks] == list(range(1, len(chunks) + 1))
+    for chunk in chunks:
+        assert len(chunk.metadata["original_text"].split("\n\n", 1)[1]) <= 300
+    # The last line of a part starts the next one
+    for first, second in zip(chunks, chunks[1:]):
+        assert first.metadata["original_text"].splitlines()[-1] == second.metadata["original_text"].split("\n\n", 1)[1].splitlines()[0]
+    text = "\n".join(chunk.metadata["original_text"] for chunk in chunks)
+    assert all(sentence in text for sentence in sentences)
+
+def test_state_carries_over_between_pieces():
+    lines = LAW.splitlines(keepends=True)
+    middle = lines.index("4. člen\n") + 3
+    splitter = CustomTextSplitter()
+    chunks = splitter.split_text_with_metadata("".join(lines[:middle]), "zdr-1.txt")
+    chunks += CustomTextSplitter(state=splitter.state).split_text_with_metadata("".join(lines[middle:]), "zdr-1.txt")
+    whole = split(LAW)
+    assert list(dict.fromkeys(chunk.metadata.get("clen") for chunk in chunks)) == list(dict.fromkeys(chunk.metadata.get("clen") for chunk in whole))
+    # The article cut between the pieces goes on with its next part
+    assert [chunk.metadata["del_clena"] for chunk in chunks_of(chunks, "4")] == [1, 2]
+    assert chunks_of(chunks, "15")[0].metadata == chunks_of(whole, "15")[0].metadata
+    assert "1. delodajalec, ki zaposluje več kot 20 delavcev, in" in "\n".join(chunk.page_content for chunk in chunks_of(chunks, "4"))
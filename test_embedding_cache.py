@@ -0,0 +1,27 @@
+from embedding_cache import CachedEmbeddings
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 1.0]
+
+def test_storing_a_key_again_does_not_count_it_twice(tmp_path):
+    cache = CachedEmbeddings(CountingEmbeddings(), "bge-m3", str(tmp_path), max_entries=10, memory_entries=1)
+    vector = cache.embed_query("Kaj določa 23. člen?")
+    # Two misses on the same question at once both store it
+    cache.store(cache.cache_key("Kaj določa 23. člen?"), vector)
+    cache.store(cache.cache_key("Kaj določa 23. člen?"), vector)
+    assert cache.stats()["disk_entries"] == 1
+
+def test_eviction_keeps_the_count_of_the_table(tmp_path):
+    embeddings = CountingEmbeddings()
+    cache = CachedEmbeddings(embeddings, "bge-m3", str(tmp_path), max_entries=10, memory_entries=1)
+    for i in range(25):
+        cache.embed_query(f"vprašanje {i}")
+        cache.store(cache.cache_key(f"vprašanje {i}"), [0.0, 1.0])
+    count = cache.connection.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+    assert cache.stats()["disk_entries"] == count <= 10
+    assert embeddings.calls == 25
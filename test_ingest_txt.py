@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import ingest_manifest as im
+import ingest_txt
+
+# A consolidated law followed by the provisions of two amending acts, both numbering their articles from 1
+LAW = """ZAKON O DELOVNIH RAZMERJIH (ZDR-1)
+
+1. člen
+(vsebina zakona)
+Ta zakon ureja delovna razmerja.
+
+2. člen
+(pojem)
+Delovno razmerje je razmerje med delavcem in delodajalcem.
+
+Zakon o spremembah in dopolnitvah Zakona o delovnih razmerjih (ZDR-1A)
+
+1. člen
+V 5. členu se besedilo spremeni.
+
+2. člen
+Ta zakon začne veljati petnajsti dan po objavi.
+
+1. člen
+V 7. členu se besedilo spremeni.
+
+2. člen
+Ta zakon začne veljati petnajsti dan po objavi.
+"""
+
+CONFIG = {"splitter_options": {"chunk_size": 1000, "chunk_overlap": 100}}
+
+# Stores chunks like Chroma does, refusing ids it already has
+class FakeRAGHandler:
+    def __init__(self, database_folder):
+        self.manifest = im.IngestManifest(database_folder)
+        self.vector_store = SimpleNamespace(_collection=SimpleNamespace(name="laws", get=lambda **kwargs: {"ids": []}))
+        self.stored = {}
+
+    def add_chunks_to_chroma(self, chunks, source, collection_name=None, ids=None):
+        assert len(set(ids)) == len(ids) and not set(ids) & set(self.stored), "duplicate chunk ids"
+        self.stored.update(zip(ids, chunks))
+        self.manifest.add_chunk_ids(collection_name, source, ids)
+        return ids
+
+    def delete_chunks(self, source, ids, collection_name=None):
+        for chunk_id in ids:
+            self.stored.pop(chunk_id, None)
+        self.manifest.remove_chunk_ids(collection_name, source, ids)
+        return len(ids)
+
+def test_repeated_article_numbers_get_their_own_chunks(tmp_path):
+    path = tmp_path / "zdr-1.txt"
+    path.write_text(LAW, encoding="utf-8")
+    rag_handler = FakeRAGHandler(str(tmp_path / "database"))
+
+    count, removed = ingest_txt.ingest_streaming(rag_handler, CONFIG, str(path), "zdr-1.txt", batch_size=2)
+    assert removed == 0
+    assert count == len(rag_handler.stored)
+    texts = [chunk.page_content for chunk in rag_handler.stored.values()]
+    assert sum("ta zakon začne veljati petnajsti dan po objavi." in text for text in texts) == 2
+
+    # Ingesting the same file again writes the same ids and removes nothing
+    ids = set(rag_handler.stored)
+    rag_handler.stored.clear()
+    count, removed = ingest_txt.ingest_streaming(rag_handler, CONFIG, str(path), "zdr-1.txt", batch_size=2)
+    assert removed == 0
+    assert set(rag_handler.stored) == ids
@@ -0,0 +1,27 @@
+from langchain_core.documents import Document
+
+from rag_handler import article_chunks_for_query, find_article_reference, reciprocal_rank_fusion
+
+def test_one_article_is_found():
+    assert find_article_reference("Kaj določa 23. člen?") == "23"
+    assert find_article_reference("Kaj pravi člen št. 23 ZDR-1?") == "23"
+    assert find_article_reference("What does article 23 say?") == "23"
+
+def test_several_articles_are_not_an_article_reference():
+    for query in ["23. in 24. člen", "23., 24. ali 25. člen", "členi 23 do 25", "člena 23 in 25", "člen 23, 24", "article 23 and 24", "article 23-25"]:
+        assert find_article_reference(query) is None, query
+
+def test_article_chunks_of_several_laws_need_the_law_named():
+    docs = [Document("", metadata={"source_file": "zdr-1.txt"}), Document("", metadata={"source_file": "zpiz-2.txt"})]
+    assert article_chunks_for_query("Kaj določa 23. člen?", docs) == []
+    assert article_chunks_for_query("Kaj določa 23. člen ZPIZ-2?", docs) == docs[1:]
+    assert article_chunks_for_query("Kaj določa 23. člen?", docs[:1]) == docs[:1]
+
+def test_fusion_keeps_the_same_chunk_of_different_collections_apart():
+    results = [
+        [Document("a", metadata={"collection": "src"}, id="1"), Document("b", metadata={"collection": "src"}, id="2")],
+        [Document("a", metadata={"collection": "dst"}, id="1")],
+    ]
+    docs = reciprocal_rank_fusion(results, key=lambda doc: (doc.metadata["collection"], doc.id))
+    assert sorted((doc.metadata["collection"], doc.id) for doc in docs) == [("dst", "1"), ("src", "1"), ("src", "2")]
+    assert len(reciprocal_rank_fusion(results)) == 2
@@ -0,0 +1,168 @@
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+import numpy as np
+
+import custom_formatter as cf
+import rag_handler as rh
+import script_helpers as sh
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger().handlers[0].setFormatter(cf.CustomFormatter())
+
+# Measure recall against latency and memory of HNSW settings on the vectors of an existing collection.
+# The vectors are loaded once, queries are sampled from them and held out of the index (or embedded from a JSONL file
+# of questions), their exact nearest neighbours are found by brute force, and an HNSW index is built with hnswlib
+# (the index Chroma implements, installed from requirements.txt) for every M and construction_ef.
+# Every search_ef is then measured on it.
+
+def parse_list(text):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+def load_vectors(collection, limit, batch_size=5000):
+    total = min(collection.count(), limit) if limit else collection.count()
+    vectors = None
+    offset = 0
+    while offset < total:
+        batch = collection.get(limit=min(batch_size, total - offset), offset=offset, include=["embeddings"])
+        if not batch["ids"]:
+            break
+        embeddings = np.asarray(batch["embeddings"], dtype=np.float32)
+        if vectors is None:
+            vectors = np.empty((total, embeddings.shape[1]), dtype=np.float32)
+        vectors[offset:offset + len(embeddings)] = embeddings
+        offset += len(embeddings)
+    return vectors[:offset]
+
+# Exact k nearest neighbours of every query, in the metric of the index
+def exact_neighbours(vectors, queries, space, k, block_size=64):
+    if space == "cosine":
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    squared_norms = (vectors ** 2).sum(axis=1) if space == "l2" else None
+    neighbours = []
+    for start in range(0, len(queries), block_size):
+        block = queries[start:start + block_size]
+        # Smaller is nearer: squared l2 distance without the constant query norm, or negative similarity
+        distances = squared_norms - 2 * block @ vectors.T if space == "l2" else -(block @ vectors.T)
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        neighbours += [set(row.tolist()) for row in nearest]
+    return neighbours
+
+# Memory of an hnswlib index: the vector, the links of the bottom layer and the label of every element
+def index_bytes(count, dimensions, m):
+    return count * (4 * dimensions + 4 * (2 * m + 1) + 8)
+
+def measure(index, queries, exact, k, search_ef):
+    index.set_ef(max(search_ef, k))
+    seconds = []
+    found = 0
+    for query, expected in zip(queries, exact):
+        start = time.perf_counter()
+        labels, _ = index.knn_query(query, k=k)
+        seconds.append(time.perf_counter() - start)
+        found += len(expected & set(labels[0].tolist()))
+    milliseconds = [value * 1000 for value in seconds]
+    return {
+        f"recall_at_{k}": round(found / (k * len(queries)), 4),
+        "p50_ms": round(sh.percentile(milliseconds, 0.50), 3),
+        "p99_ms": round(sh.percentile(milliseconds, 0.99), 3),
+    }
+
+def main():
+    config = sh.load_config()
+    index_options = config.get("index_options", {})
+    parser = argparse.ArgumentParser(description="Sweep HNSW settings on a collection, reporting recall@k, latency and memory.")
+    parser.add_argument("--collection-name", type=str, default=config["rag_options"]["collection_name"])
+    parser.add_argument("--queries", type=int, default=200,
+                help="Number of stored vectors sampled as queries.\n")
+    parser.add_argument("--questions-file", type=str, default=None,
+                help="JSONL file of {\"question\": ...} objects to embed and use as queries instead.\n")
+    parser.add_argument("--k", type=int, default=config["rag_options"]["results_to_return"])
+    parser.add_argument("--space", type=str, default=None, choices=["l2", "cosine", "ip"],
+                help="Distance metric, the one of the collection by default.\n")
+    parser.add_argument("--m", type=str, default=str(index_options.get("M", 16)),
+                help="Comma separated M values.\n")
+    parser.add_argument("--construction-ef", type=str, default=str(index_options.get("construction_ef", 100)),
+                help="Comma separated construction_ef values.\n")
+    parser.add_argument("--search-ef", type=str, default="10,20,40,80,160,320",
+                help="Comma separated search_ef values.\n")
+    parser.add_argument("--max-vectors", type=int, default=0,
+                help="Only load this many vectors of the collection, 0 loads all of them.\n")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=str, default="tune_results.json",
+                help="File the results are written to.\n")
+    args = parser.parse_args()
+
+    import hnswlib
+
+    try:
+        rag_handler = rh.RAGHandler(config)
+        # Opening a collection creates it, so the name is checked first
+        if args.collection_name not in [coll.name for coll in rag_handler.list_collections()]:
+            raise ValueError(f"Collection {args.collection_name} does not exist.")
+        collection = rag_handler.get_vector_store(args.collection_name)._collection
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+    if collection.count() == 0:
+        logging.error(f"Collection {args.collection_name} is empty.")
+        sys.exit(1)
+    space = args.space or (collection.metadata or {}).get("hnsw:space", "l2")
+
+    start = time.perf_counter()
+    vectors = load_vectors(collection, args.max_vectors)
+    logging.info(f"Loaded {len(vectors)} vectors of {vectors.shape[1]} dimensions in {time.perf_counter() - start:.1f}s")
+    if args.questions_file:
+        with open(args.questions_file, mode="r", encoding="utf-8") as read_file:
+            questions = [json.loads(line)["question"] for line in read_file if line.strip()]
+        queries = np.asarray([rag_handler.embed_query(question) for question in questions], dtype=np.float32)
+    else:
+        # Sampled vectors are left out of the index, or every query would find itself and recall would be too high
+        rng = random.Random(args.seed)
+        held_out = np.zeros(len(vectors), dtype=bool)
+        held_out[rng.sample(range(len(vectors)), min(args.queries, len(vectors) - 1))] = True
+        queries = vectors[held_out]
+        vectors = vectors[~held_out]
+    if len(queries) == 0:
+        logging.error(f"Collection {args.collection_name} has too few vectors to sample queries from.")
+        sys.exit(1)
+    k = min(args.k, len(vectors))
+
+    start = time.perf_counter()
+    exact = exact_neighbours(vectors, queries, space, k)
+    logging.info(f"Exact neighbours of {len(queries)} queries found in {time.perf_counter() - start:.1f}s")
+
+    results = {"collection": args.collection_name, "count": len(vectors), "dimensions": vectors.shape[1], "space": space, "k": k, "queries": len(queries), "runs": []}
+    for m in parse_list(args.m):
+        for construction_ef in parse_list(args.construction_ef):
+            start = time.perf_counter()
+            index = hnswlib.Index(space=space, dim=vectors.shape[1])
+            index.init_index(max_elements=len(vectors), ef_construction=construction_ef, M=m, random_seed=args.seed)
+            index.add_items(vectors, np.arange(len(vectors)))
+            build_seconds = time.perf_counter() - start
+            for search_ef in parse_list(args.search_ef):
+                run = {
+                    "M": m,
+                    "construction_ef": construction_ef,
+                    "search_ef": search_ef,
+                    "build_seconds": round(build_seconds, 2),
+                    "memory_mb": round(index_bytes(len(vectors), vectors.shape[1], m) / 2 ** 20, 1),
+                    **measure(index, queries, exact, k, search_ef),
+                }
+                results["runs"].append(run)
+                logging.info(
+                    f"M {m}, construction_ef {construction_ef}, search_ef {search_ef}: recall@{k} {run[f'recall_at_{k}']}, "
+                    f"p50 {run['p50_ms']} ms, p99 {run['p99_ms']} ms, {run['memory_mb']} MB, built in {run['build_seconds']}s"
+                )
+            del index
+
+    with open(args.output, mode="w", encoding="utf-8") as write_file:
+        json.dump(results, write_file, indent=4)
+    logging.info(f"Results written to: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,24 @@
+import startup_timer as st
+startup_timer = st.StartupTimer()
+
+import hashlib
 import json
 import logging
 import os
-from flask import Flask, request, jsonify, render_template
+import re
+import threading
+from flask import Flask, Response, request, jsonify, render_template, send_file, session, stream_with_context
+from watchdog.observers import Observer
 import rag_handler as rh
+import answer_cache as ac
+import batch_answering as ba
+import ingestion_pipeline as ip
 import model_handler as mh
 import custom_formatter as cf
+import session_store as ss
+import metrics as mt
+
+startup_timer.mark("imports")
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.getLogger().handlers[0].setFormatter(cf.CustomFormatter())
@@ -23,59 +37,279 @@ if os.path.exists("config.local.json"):
             else:
                 config[key] = value
 
-# Initialize model and RAG handlers
-model_handler = mh.ModelHandler(config)
-rag_handler = rh.RAGHandler(config)
-
-# Load the model
-model = model_handler.load_model()
-if not model:
-    logging.error("Error loading model. Make sure you have installed the model and Ollama is running. Exiting...")
-    exit(1)
-if config["rag_options"]["clear_database_on_start"] and rag_handler.vector_store._collection.count() > 0:
-    rag_handler.vector_store.reset_collection()
+web_options = config.get("web_options", {})
+# Caps the number of answers generated at the same time, the rest wait for a free slot
+generation_slots = threading.BoundedSemaphore(web_options.get("max_concurrent_generations", 4))
+generation_wait_seconds = web_options.get("generation_wait_seconds", 60)
+# Batch jobs by id, their questions and answers are kept in the batch folder of the database
+batch_jobs = {}
+batch_lock = threading.Lock()
+max_batch_jobs = config.get("batch_options", {}).get("max_jobs", 1)
 
 app = Flask(__name__)
+app.secret_key = web_options.get("secret_key") or os.urandom(32)
+
+# Get the state of the session of the current request
+def get_session_state():
+    if "id" not in session:
+        session["id"] = sessions.new_id()
+    return sessions.get(session["id"])
+
+# Embed the question once for the answer cache and retrieval,
+# returns (query_embedding, collection version to store the answer with, cached answer or None).
+# The version is None when the answer is not to be cached.
+def lookup_answer(user_input, collection_name):
+    if not answer_cache or not answer_cache.caches(user_input):
+        return None, None, None
+    with mt.span("embed_query"):
+        query_embedding = rag_handler.embed_query(user_input)
+    return query_embedding, *answer_cache.lookup(collection_name, query_embedding)
 
 @app.route("/", methods=["GET"])
 def index():
     return render_template("index.html")
 
-@app.route("/ask", methods=["POST"])
-def ask():
-    data = request.get_json()
-    user_input = data.get("question", "")
-    if not user_input:
-        return jsonify({"error": "No question provided."}), 400
+@app.route("/ingest/status", methods=["GET"])
+def ingest_status():
+    return jsonify(ingestion_pipeline.status())
 
+# Handle collection commands, returns a (response, status) tuple or None if the input is a question
+def run_command(user_input, state):
     if user_input == "list collections":
         collections = rag_handler.list_collections()
         response = "Available Collections:\n"
         for idx, coll in enumerate(collections):
             response += f"- {idx+1}. {coll.name}\n"
-        return jsonify({"response": response, "done_reason": "stop", "total_tokens": 0})
+        return {"response": response, "done_reason": "stop", "total_tokens": 0}, 200
+
+    if user_input == "clear":
+        with state["lock"]:
+            state["history"].clear()
+        return {"response": "Conversation history cleared.", "done_reason": "stop", "total_tokens": 0}, 200
 
     if user_input.startswith("switch collection to "):
         collections = rag_handler.list_collections()
         collection_idx = user_input.replace("switch collection to ", "").strip()
         if not collection_idx.isdigit() or int(collection_idx) < 1 or int(collection_idx) > len(collections):
-            return jsonify({"error": "Invalid collection index."}), 400
+            return {"error": "Invalid collection index."}, 400
 
         new_collection_name = collections[int(collection_idx)-1].name
-        rag_handler.change_collection(new_collection_name)
-        return jsonify({"response": f"Switched to \"{new_collection_name}\"", "done_reason": "stop", "total_tokens": 0})
+        try:
+            rag_handler.get_vector_store(new_collection_name)
+        except ValueError as e:
+            return {"error": str(e)}, 409
+        state["collection"] = new_collection_name
+        return {"response": f"Switched to \"{new_collection_name}\"", "done_reason": "stop", "total_tokens": 0}, 200
 
-    if rag_handler.vector_store._collection.count() > 0:
-        related_docs = rag_handler.get_docs_by_similarity(user_input)
-        response = model_handler.get_response(user_input, related_docs, True)
-    else:
-        response = model_handler.get_response(user_input, None, False)
+    return None
 
-    return jsonify({
+# Answer a question for a session, returns a (response, status) tuple
+def answer_question(user_input, state):
+    command = run_command(user_input, state)
+    if command:
+        return command
+
+    collection_name = rag_handler.search_scope(state["collection"])
+    query_embedding, cache_version, cached = lookup_answer(user_input, collection_name)
+    if cached:
+        return {"response": cached[0], "done_reason": cached[1].get("done_reason"), "total_tokens": cached[1].get("total_tokens")}, 200
+
+    related_docs = None
+    if rag_handler.has_documents(collection_name):
+        related_docs = rag_handler.search(user_input, query_embedding, collection_name)
+
+    # One question at a time per session, so its history stays in order.
+    # The session lock is taken before a generation slot, so a session waiting for itself does not hold a slot.
+    with state["lock"]:
+        with mt.span("generation_wait"):
+            acquired = generation_slots.acquire(timeout=generation_wait_seconds)
+        if not acquired:
+            return {"error": "Too many questions are being answered right now, try again later."}, 503
+        try:
+            response = model_handler.get_response(user_input, related_docs, related_docs is not None, state["history"])
+        finally:
+            generation_slots.release()
+    if cache_version is not None and response.content:
+        answer_cache.store(collection_name, cache_version, query_embedding, response.content, response.response_metadata)
+
+    return {
         "response": response.content,
         "done_reason": response.response_metadata.get("done_reason"),
         "total_tokens": response.response_metadata.get("total_tokens")
-    })
+    }, 200
+
+# Pass "timings": true to get the time spent in every stage, in milliseconds
+@app.route("/ask", methods=["POST"])
+def ask():
+    data = request.get_json()
+    user_input = data.get("question", "")
+    if not user_input:
+        return jsonify({"error": "No question provided."}), 400
+
+    with mt.collect_timings() as timings:
+        with mt.span("request"):
+            response, status = answer_question(user_input, get_session_state())
+    if data.get("timings"):
+        response["timings"] = {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+    return jsonify(response), status
+
+# Prometheus metrics: latency histograms per stage and cache, ingestion and generation counters
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(mt.render(), mimetype="text/plain; version=0.0.4")
+
+def batch_folder(job_id):
+    return os.path.join(config["rag_options"]["database_folder"], "batch", job_id)
+
+# Start answering a JSONL body of questions in the background, see batch_answering.py.
+# The job id is a hash of the questions, posting the same questions again resumes an interrupted job.
+@app.route("/batch", methods=["POST"])
+def batch():
+    body = request.get_data()
+    try:
+        questions = [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        return jsonify({"error": f"Invalid JSONL: {e}"}), 400
+    if not questions:
+        return jsonify({"error": "No questions provided."}), 400
+
+    job_id = hashlib.sha256(body).hexdigest()[:16]
+    folder = batch_folder(job_id)
+    with batch_lock:
+        job = batch_jobs.get(job_id)
+        if job is None or not job.status()["running"]:
+            if sum(other.status()["running"] for other in batch_jobs.values()) >= max_batch_jobs:
+                return jsonify({"error": "Too many batch jobs are running right now, try again later."}), 503
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, "questions.jsonl"), mode="wb") as write_file:
+                write_file.write(body)
+            job = ba.BatchAnswerer(config, rag_handler, model_handler, generation_slots)
+            batch_jobs[job_id] = job
+            job.start(os.path.join(folder, "questions.jsonl"), os.path.join(folder, "answers.jsonl"), collection_name=get_session_state()["collection"])
+    return jsonify({"job": job_id, **job.status()}), 202
+
+@app.route("/batch/<job_id>", methods=["GET"])
+def batch_status(job_id):
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown batch job."}), 404
+    return jsonify({"job": job_id, **job.status()})
+
+# The answers written so far, one JSON object per line
+@app.route("/batch/<job_id>/answers", methods=["GET"])
+def batch_answers(job_id):
+    path = os.path.join(batch_folder(job_id), "answers.jsonl")
+    if not re.fullmatch(r"[0-9a-f]{16}", job_id) or not os.path.exists(path):
+        return jsonify({"error": "Unknown batch job."}), 404
+    return send_file(os.path.abspath(path), mimetype="application/x-ndjson")
+
+# Server-sent event with a JSON payload
+def sse(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+# Same as /ask, but the answer is streamed as server-sent events:
+# {"token": ...} events as tokens arrive, then one {"done_reason": ..., "total_tokens": ...} event
+@app.route("/ask/stream", methods=["POST"])
+def ask_stream():
+    data = request.get_json()
+    user_input = data.get("question", "")
+    if not user_input:
+        return jsonify({"error": "No question provided."}), 400
+
+    state = get_session_state()
+    command = run_command(user_input, state)
+    if command:
+        return jsonify(command[0]), command[1]
+
+    collection_name = rag_handler.search_scope(state["collection"])
+    query_embedding, cache_version, cached = lookup_answer(user_input, collection_name)
+    if cached:
+        events = sse({"token": cached[0]}) + sse({"done_reason": cached[1].get("done_reason"), "total_tokens": cached[1].get("total_tokens")})
+        return Response(events, mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    related_docs = None
+    if rag_handler.has_documents(collection_name):
+        related_docs = rag_handler.search(user_input, query_embedding, collection_name)
+
+    # The session lock and then a generation slot are held until the stream ends or the client goes away
+    def generate():
+        metadata = {}
+        answer = ""
+        with state["lock"]:
+            if not generation_slots.acquire(timeout=generation_wait_seconds):
+                yield sse({"error": "Too many questions are being answered right now, try again later."})
+                return
+            try:
+                for chunk in model_handler.stream_response(user_input, related_docs, related_docs is not None, state["history"]):
+                    metadata.update(chunk.response_metadata)
+                    if chunk.content:
+                        answer += chunk.content
+                        yield sse({"token": chunk.content})
+            except Exception as e:
+                logging.error(f"Error while streaming response: {e}")
+                yield sse({"error": str(e)})
+                return
+            finally:
+                generation_slots.release()
+        if cache_version is not None and answer:
+            answer_cache.store(collection_name, cache_version, query_embedding, answer, metadata)
+        yield sse({"done_reason": metadata.get("done_reason"), "total_tokens": metadata.get("total_tokens")})
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Start-up is only run by the script itself, not when the module is imported by the ingestion worker processes
+def start():
+    global model_handler, rag_handler, answer_cache, ingestion_pipeline, observer, sessions
+    # Initialize model and RAG handlers, the model is checked once here
+    model_handler = mh.ModelHandler(config)
+    startup_timer.mark("model validation")
+    try:
+        rag_handler = rh.RAGHandler(config)
+    except ValueError as e:
+        logging.error(e)
+        exit(1)
+    startup_timer.mark("chroma open")
+
+    # Load the model into Ollama and the reranker model in the background, they are needed by the first question
+    if config["llm_options"].get("warm_up", True):
+        startup_timer.run_in_background("model warm-up", model_handler.warm_up)
+    if config["rag_options"].get("use_reranker", False) and config.get("reranker_options", {}).get("preload", True):
+        startup_timer.run_in_background("reranker load", rag_handler.reranker.load_model)
+    if hasattr(rag_handler.document_embeddings, "load_model"):
+        startup_timer.run_in_background("embedding model load", rag_handler.document_embeddings.load_model)
+
+    if config["rag_options"]["clear_database_on_start"] and rag_handler.vector_store._collection.count() > 0:
+        rag_handler.reset_collection()
+
+    # Answers can only be reused when they do not depend on the conversation so far
+    answer_cache = None
+    if config.get("cache_options", {}).get("answer_cache", False) and not config["llm_options"]["use_short_term_memory"]:
+        answer_cache = ac.AnswerCache(config, rag_handler.manifest)
+
+    # Start the ingestion pipeline and the folder observer feeding it
+    ingestion_pipeline = ip.IngestionPipeline(config, rag_handler)
+    ingestion_pipeline.start()
+    observer = Observer()
+    observer.schedule(ip.FileSystemWatcher(ingestion_pipeline), path=config["rag_options"]["ingestion_folder"], recursive=True)
+    observer.start()
+    startup_timer.mark("ingestion start")
+    startup_timer.report()
+
+    # Retrieval and model clients are shared, the collection and history are kept per session
+    sessions = ss.SessionStore(config["rag_options"]["collection_name"], web_options.get("session_timeout", 3600), model_handler.new_conversation)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    start()
+    host = web_options.get("host", "0.0.0.0")
+    port = web_options.get("port", 5000)
+    if web_options.get("debug", False):
+        app.run(host=host, port=port, debug=True, threaded=True)
+    else:
+        # Serve with waitress if it is installed, it handles every request on its own worker thread
+        try:
+            from waitress import serve
+        except ImportError:
+            logging.warning("waitress is not installed, falling back to the threaded Flask server.")
+            app.run(host=host, port=port, threaded=True)
+        else:
+            serve(app, host=host, port=port, threads=web_options.get("threads", 16))
\ No newline at end of file